@@ -1,22 +1,89 @@
 import sqlite3
 import os
 import logging
-import time
-from utils.resource_handler import get_database_path
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from utils.resource_handler import get_database_path, get_config
 from utils.logger import logger
+from database.mapping_cache import MappingCache
+
+# Número máximo de tentativas quando o banco está bloqueado
+MAX_RETRIES = 3
+# Mapeamentos mais antigos que este número de dias são removidos pela manutenção
+RETENTION_DAYS = 30
+# Quantidade de linhas removidas por lote na manutenção, para não segurar o banco por muito tempo
+MAINTENANCE_BATCH_SIZE = 5000
+# Versão do esquema gravada em PRAGMA user_version (2 = tabela message_map, um mapeamento por destino)
+SCHEMA_VERSION = 2
+# Máximo de parâmetros por consulta IN (...) (o limite padrão do SQLite antigo é 999)
+SQL_IN_CHUNK_SIZE = 500
+# Group commit dos mapeamentos: grava o buffer a cada N ms ou quando acumular M linhas
+WRITE_BUFFER_FLUSH_MS = 200
+WRITE_BUFFER_MAX_ROWS = 200
+# Cache LRU dos mapeamentos recentes: número máximo de entradas e validade (s)
+MAPPING_CACHE_SIZE = 50000
+MAPPING_CACHE_TTL = 3600
 
 class DatabaseManager:
-    def __init__(self, db_path: str = None):
+    """
+    Gerencia o mapeamento de IDs de mensagens no SQLite.
+
+    Todas as operações públicas são corrotinas: o SQL roda em uma thread dedicada
+    ao banco (um executor de uma única thread, que funciona como fila de requisições),
+    de forma que o event loop nunca fica bloqueado esperando o disco ou um lock do SQLite.
+
+    Os novos mapeamentos passam por um buffer de escrita (write-behind) que é gravado
+    em uma única transação a cada flush_interval_ms ou a cada flush_max_rows linhas.
+    As leituras consultam o buffer antes do banco, então edições e exclusões enxergam
+    mapeamentos que ainda não foram gravados.
+
+    Na frente de tudo fica um cache LRU/TTL dos mapeamentos recentes, alimentado pelas
+    inserções e leituras e invalidado pelas exclusões.
+
+    A tabela 'source_state' guarda o ID da última mensagem replicada de cada chat de
+    origem (usado pelo backfill); ela é atualizada junto com o buffer de escrita e
+    espelhada em memória, para que o backfill tire uma cópia síncrona dos valores
+    antes que mensagens ao vivo os avancem.
+
+    A tabela 'outbox' guarda os envios (mensagem de origem, destino) ainda não
+    concluídos: cada job é gravado antes do envio e removido na mesma transação
+    que grava o mapeamento correspondente, então sobrevive a quedas e reinícios.
+    """
+
+    def __init__(self, db_path: str = None, legacy_dest_chat=None,
+                 flush_interval_ms: int = WRITE_BUFFER_FLUSH_MS, flush_max_rows: int = WRITE_BUFFER_MAX_ROWS,
+                 cache_size: int = MAPPING_CACHE_SIZE, cache_ttl: float = MAPPING_CACHE_TTL):
         # Usar o caminho do banco de dados do resource handler
         self.db_path = db_path or get_database_path()
         
         # Garantir que o diretório do banco de dados existe
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
+        # Thread dedicada ao banco: as requisições são executadas em ordem, uma por vez
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        
+        # Buffer de escrita: (source_chat, source_msg, dest_chat) -> dest_msg
+        self._pending = {}
+        self._flush_interval = max(0, flush_interval_ms) / 1000
+        self._flush_max_rows = max(1, flush_max_rows)
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        
+        # Última mensagem replicada por chat de origem, ainda não gravada: source_chat -> source_msg
+        self._source_state = {}
+        
+        # Última mensagem processada por chat de origem (gravada ou não): source_chat -> source_msg
+        self._watermarks = {}
+        
+        # Cache dos mapeamentos recentes
+        self.cache = MappingCache(max_size=cache_size, ttl=cache_ttl)
+        
         self.conn = None
         self._connect()
         self._create_table()
-        self._maintenance()
+        self._migrate_legacy_schema(legacy_dest_chat)
+        self._load_source_state()
+        logger.info(f"Banco de dados conectado: {self.db_path}")
 
     def _connect(self):
         """Estabelece a conexão com o banco de dados."""
@@ -34,126 +101,578 @@ class DatabaseManager:
             logger.error(f"Erro ao conectar ao banco de dados: {e}")
 
     def _create_table(self) -> None:
-        """Cria a tabela para mapeamento de IDs."""
+        """Cria a tabela para mapeamento de IDs (uma linha por destino) e as tabelas auxiliares (outbox, clonagem e backfill)."""
         try:
             self.conn.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER,
-                    original_message_id INTEGER,
-                    destination_message_id INTEGER,
+                CREATE TABLE IF NOT EXISTS message_map (
+                    source_chat INTEGER NOT NULL,
+                    source_msg INTEGER NOT NULL,
+                    dest_chat INTEGER NOT NULL,
+                    dest_msg INTEGER NOT NULL,
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(chat_id, original_message_id)
+                    PRIMARY KEY (source_chat, source_msg, dest_chat)
+                )
+            ''')
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_message_map_timestamp ON message_map(timestamp)"
+            )
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    source_chat INTEGER NOT NULL,
+                    source_msg INTEGER NOT NULL,
+                    dest_chat INTEGER NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (source_chat, source_msg, dest_chat)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS clone_jobs (
+                    source_chat INTEGER NOT NULL,
+                    dest_chat INTEGER NOT NULL,
+                    last_msg INTEGER NOT NULL DEFAULT 0,
+                    copied INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (source_chat, dest_chat)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS source_state (
+                    source_chat INTEGER PRIMARY KEY,
+                    last_msg INTEGER NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
         except sqlite3.Error as e:
             logger.error(f"Erro ao criar tabela: {e}")
             self._reconnect()
+
+    def _migrate_legacy_schema(self, legacy_dest_chat) -> None:
+        """
+        Migra, uma única vez, a tabela antiga 'messages' (sem coluna de destino) para 'message_map'.
+        A tabela antiga guardava apenas o ID do último destino gravado, que é atribuído a legacy_dest_chat.
+        """
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+
+            legacy_exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+            ).fetchone()
+
+            if legacy_exists:
+                if legacy_dest_chat is None:
+                    logger.warning("Tabela antiga de mapeamentos encontrada, mas não há chat de destino configurado. Migração adiada.")
+                    return
+
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    cursor = self.conn.execute('''
+                        INSERT OR IGNORE INTO message_map (source_chat, source_msg, dest_chat, dest_msg, timestamp)
+                        SELECT chat_id, original_message_id, ?, destination_message_id, timestamp
+                        FROM messages
+                        WHERE destination_message_id IS NOT NULL
+                    ''', (legacy_dest_chat,))
+                    migrated = cursor.rowcount
+                    self.conn.execute("DROP TABLE messages")
+                    self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    self.conn.execute("COMMIT")
+                except sqlite3.Error:
+                    self.conn.execute("ROLLBACK")
+                    raise
+                logger.info(f"Migração do banco concluída: {migrated} mapeamentos atribuídos ao destino {legacy_dest_chat}")
+            else:
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao migrar banco de dados: {e}")
+    
+    def _load_source_state(self):
+        """Carrega na memória o estado dos chats de origem."""
+        try:
+            self._watermarks = dict(self.conn.execute("SELECT source_chat, last_msg FROM source_state").fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao carregar estado dos chats de origem: {e}")
     
     def _reconnect(self):
         """Reconecta ao banco de dados em caso de erro."""
-        time.sleep(1)  # Pequeno delay antes de reconectar
         self._connect()
     
-    def _execute_with_retry(self, sql, params=()):
-        """Executa comando SQL com retry em caso de bloqueio."""
-        max_retries = 3
+    async def _run(self, func, *args):
+        """Executa func(*args) na thread do banco, com backoff assíncrono se o banco estiver bloqueado."""
+        loop = asyncio.get_running_loop()
         retry_count = 0
         
-        while retry_count < max_retries:
+        while True:
             try:
-                return self.conn.execute(sql, params)
+                return await loop.run_in_executor(self._executor, func, *args)
             except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and retry_count < max_retries - 1:
+                if "database is locked" in str(e) and retry_count < MAX_RETRIES - 1:
                     retry_count += 1
-                    logger.warning(f"Banco de dados bloqueado, tentativa {retry_count}/{max_retries}")
-                    time.sleep(retry_count * 0.5)  # Tempo crescente entre tentativas
-                    self._reconnect()
+                    logger.warning(f"Banco de dados bloqueado, tentativa {retry_count}/{MAX_RETRIES}")
+                    await asyncio.sleep(retry_count * 0.5)  # Tempo crescente entre tentativas, sem bloquear o loop
+                    await loop.run_in_executor(self._executor, self._reconnect)
                 else:
                     raise
-            except sqlite3.Error as e:
-                logger.error(f"Erro ao executar SQL: {e}")
-                raise
     
-    def _maintenance(self) -> None:
-        """Realiza manutenção periódica do banco de dados."""
+    async def _run_safe(self, func, *args, error_message, default=None):
+        """Executa func no banco registrando erros do SQLite e reconectando em caso de falha."""
         try:
-            # Conta registros antes da limpeza
-            cursor = self._execute_with_retry("SELECT COUNT(*) FROM messages")
-            count_before = cursor.fetchone()[0]
-            
-            # Remove mapeamentos mais antigos que 30 dias
-            self._execute_with_retry('''
-                DELETE FROM messages
-                WHERE timestamp < datetime('now', '-30 day')
-            ''')
-            
-            # Conta registros após a limpeza
-            cursor = self._execute_with_retry("SELECT COUNT(*) FROM messages")
-            count_after = cursor.fetchone()[0]
+            return await self._run(func, *args)
+        except sqlite3.Error as e:
+            logger.error(f"{error_message}: {e}")
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._reconnect)
+            return default
+    
+    def _maintenance_batch(self, days, batch_size):
+        """Remove um lote de mapeamentos antigos. Retorna a quantidade removida."""
+        cursor = self.conn.execute('''
+            DELETE FROM message_map WHERE rowid IN (
+                SELECT rowid FROM message_map
+                WHERE timestamp < datetime('now', ?)
+                LIMIT ?
+            )
+        ''', (f'-{int(days)} day', batch_size))
+        return cursor.rowcount
+
+    def _maintenance_finish(self):
+        """Atualiza estatísticas do planejador e trunca o WAL após a limpeza."""
+        self.conn.execute("PRAGMA optimize")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # ----- Operações síncronas (executadas apenas na thread do banco) -----
+
+    def _insert_many(self, rows, source_states=()):
+        """
+        Grava vários mapeamentos em uma única transação (um único fsync do WAL),
+        concluindo os jobs do outbox correspondentes e avançando o estado dos chats de origem.
+        """
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany('''
+                INSERT INTO source_state (source_chat, last_msg, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(source_chat) DO UPDATE SET
+                    last_msg = MAX(last_msg, excluded.last_msg),
+                    updated_at = CURRENT_TIMESTAMP
+            ''', source_states)
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO message_map
+                (source_chat, source_msg, dest_chat, dest_msg, timestamp)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', rows)
+            self.conn.executemany('''
+                DELETE FROM outbox WHERE source_chat = ? AND source_msg = ? AND dest_chat = ?
+            ''', [row[:3] for row in rows])
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _get_mapped_message_id(self, source_chat, source_msg, dest_chat):
+        cursor = self.conn.execute('''
+            SELECT dest_msg FROM message_map
+            WHERE source_chat = ? AND source_msg = ? AND dest_chat = ?
+        ''', (source_chat, source_msg, dest_chat))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def _get_mapped_messages(self, source_chat, source_msg):
+        cursor = self.conn.execute('''
+            SELECT dest_chat, dest_msg FROM message_map
+            WHERE source_chat = ? AND source_msg = ?
+        ''', (source_chat, source_msg))
+        return dict(cursor.fetchall())
+
+    def _get_mapped_messages_bulk(self, source_chat, source_msgs):
+        mapped = {}
+        for i in range(0, len(source_msgs), SQL_IN_CHUNK_SIZE):
+            chunk = source_msgs[i:i + SQL_IN_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.conn.execute(f'''
+                SELECT source_msg, dest_chat, dest_msg FROM message_map
+                WHERE source_chat = ? AND source_msg IN ({placeholders})
+            ''', (source_chat, *chunk))
+            for source_msg, dest_chat, dest_msg in cursor.fetchall():
+                mapped.setdefault(source_msg, {})[dest_chat] = dest_msg
+        return mapped
+
+    def _delete_mappings(self, source_chat, source_msgs, dest_chat=None):
+        for i in range(0, len(source_msgs), SQL_IN_CHUNK_SIZE):
+            chunk = source_msgs[i:i + SQL_IN_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            if dest_chat is None:
+                self.conn.execute(f'''
+                    DELETE FROM message_map
+                    WHERE source_chat = ? AND source_msg IN ({placeholders})
+                ''', (source_chat, *chunk))
+            else:
+                self.conn.execute(f'''
+                    DELETE FROM message_map
+                    WHERE source_chat = ? AND source_msg IN ({placeholders}) AND dest_chat = ?
+                ''', (source_chat, *chunk, dest_chat))
+
+    def _delete_mapping(self, source_chat, source_msg, dest_chat):
+        if dest_chat is None:
+            self.conn.execute('''
+                DELETE FROM message_map
+                WHERE source_chat = ? AND source_msg = ?
+            ''', (source_chat, source_msg))
+        else:
+            self.conn.execute('''
+                DELETE FROM message_map
+                WHERE source_chat = ? AND source_msg = ? AND dest_chat = ?
+            ''', (source_chat, source_msg, dest_chat))
+
+    def _count_mappings(self, since_days):
+        if since_days is None:
+            cursor = self.conn.execute("SELECT COUNT(*) FROM message_map")
+        else:
+            cursor = self.conn.execute(
+                "SELECT COUNT(*) FROM message_map WHERE timestamp > datetime('now', ?)",
+                (f'-{int(since_days)} day',)
+            )
+        return cursor.fetchone()[0]
+
+    def _get_outbox_jobs(self):
+        cursor = self.conn.execute('''
+            SELECT source_chat, source_msg, dest_chat FROM outbox
+            ORDER BY source_chat, source_msg
+        ''')
+        return cursor.fetchall()
+
+    def _update_outbox_jobs(self, sql, rows):
+        """Executa sql para cada job em uma única transação."""
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(sql, rows)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _purge_outbox(self, max_attempts):
+        cursor = self.conn.execute("DELETE FROM outbox WHERE attempts >= ?", (max_attempts,))
+        return cursor.rowcount
+
+    def _get_clone_job(self, source_chat, dest_chat):
+        cursor = self.conn.execute('''
+            SELECT last_msg, copied, status FROM clone_jobs
+            WHERE source_chat = ? AND dest_chat = ?
+        ''', (source_chat, dest_chat))
+        return cursor.fetchone()
+
+    def _save_clone_job(self, source_chat, dest_chat, last_msg, copied, status):
+        self.conn.execute('''
+            INSERT INTO clone_jobs (source_chat, dest_chat, last_msg, copied, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(source_chat, dest_chat) DO UPDATE SET
+                last_msg = excluded.last_msg,
+                copied = excluded.copied,
+                status = excluded.status,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (source_chat, dest_chat, last_msg, copied, status))
+
+    def _list_clone_jobs(self):
+        cursor = self.conn.execute('''
+            SELECT source_chat, dest_chat, last_msg, copied, status, updated_at FROM clone_jobs
+            ORDER BY updated_at DESC
+        ''')
+        return cursor.fetchall()
+
+    def _count_outbox_jobs(self):
+        return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    # ----- API assíncrona -----
+
+    async def insert_message(self, source_chat: int, source_msg: int, dest_chat: int, dest_msg: int) -> None:
+        """Adiciona o mapeamento de uma mensagem em um destino ao buffer de escrita."""
+        self._pending[(source_chat, source_msg, dest_chat)] = dest_msg
+        self.cache.put(source_chat, source_msg, dest_chat, dest_msg)
+        
+        if len(self._pending) >= self._flush_max_rows:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def note_source_message(self, source_chat: int, source_msg: int) -> None:
+        """Registra (no buffer de escrita) que a mensagem de origem já foi processada."""
+        if source_msg > self._source_state.get(source_chat, 0):
+            self._source_state[source_chat] = source_msg
+        if source_msg > self._watermarks.get(source_chat, 0):
+            self._watermarks[source_chat] = source_msg
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def get_source_watermarks(self) -> dict:
+        """
+        Retorna uma cópia de {source_chat: última mensagem processada}. É síncrona de
+        propósito: quem chama tira a cópia antes de qualquer mensagem ao vivo ser processada.
+        """
+        return dict(self._watermarks)
+
+    def _cancel_flush_task(self):
+        """Cancela o flush atrasado pendente, se houver."""
+        flush_task = getattr(self, '_flush_task', None)
+        if flush_task is not None and not flush_task.done():
+            flush_task.cancel()
+        self._flush_task = None
+
+    async def _flush_later(self):
+        """Grava o buffer após o intervalo de group commit."""
+        await asyncio.sleep(self._flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Grava todos os mapeamentos do buffer em uma única transação."""
+        async with self._flush_lock:
+            if not self._pending and not self._source_state:
+                return
             
-            # Fecha conexão antes do VACUUM
-            self.conn.close()
+            batch = dict(self._pending)
+            rows = [key + (dest_msg,) for key, dest_msg in batch.items()]
+            states = dict(self._source_state)
+            try:
+                await self._run(self._insert_many, rows, list(states.items()))
+            except sqlite3.Error as e:
+                # Mantém as linhas no buffer para a próxima tentativa
+                logger.error(f"Erro ao gravar {len(rows)} mapeamentos no banco de dados: {e}")
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._reconnect)
+                if self._flush_task is None or self._flush_task.done():
+                    self._flush_task = asyncio.create_task(self._flush_later())
+                return
             
-            # Reconecta e executa VACUUM em uma nova conexão
-            temp_conn = sqlite3.connect(self.db_path)
-            temp_conn.execute("VACUUM")
-            temp_conn.close()
+            # Remove do buffer apenas o que foi gravado e não mudou durante a gravação
+            for key, dest_msg in batch.items():
+                if self._pending.get(key) == dest_msg:
+                    del self._pending[key]
+            for source_chat, source_msg in states.items():
+                if self._source_state.get(source_chat) == source_msg:
+                    del self._source_state[source_chat]
+
+    async def get_mapped_message_id(self, source_chat: int, source_msg: int, dest_chat: int) -> int:
+        """Recupera o ID da mensagem em um destino, com base no ID original."""
+        cached = self.cache.get(source_chat, source_msg, dest_chat)
+        if cached is not None:
+            return cached
+        
+        pending = self._pending.get((source_chat, source_msg, dest_chat))
+        if pending is not None:
+            return pending
+        
+        generation = self.cache.generation()
+        dest_msg = await self._run_safe(
+            self._get_mapped_message_id, source_chat, source_msg, dest_chat,
+            error_message="Erro ao recuperar ID mapeado"
+        )
+        if dest_msg is not None:
+            self.cache.put(source_chat, source_msg, dest_chat, dest_msg, since=generation)
+        return dest_msg
+
+    async def get_mapped_messages(self, source_chat: int, source_msg: int, dest_chats=None) -> dict:
+        """
+        Recupera os IDs da mensagem em todos os destinos ({dest_chat: dest_msg}) em uma única consulta.
+        Se dest_chats for informado e todos estiverem no cache, o banco não é consultado.
+        """
+        if dest_chats:
+            cached = self.cache.get_many(source_chat, source_msg, dest_chats)
+            if cached is not None:
+                return cached
+        
+        generation = self.cache.generation()
+        mapped = await self._run_safe(
+            self._get_mapped_messages, source_chat, source_msg,
+            error_message="Erro ao recuperar IDs mapeados",
+            default={}
+        )
+        
+        # Complementa com os mapeamentos que ainda estão no buffer
+        for (pending_chat, pending_msg, dest_chat), dest_msg in self._pending.items():
+            if pending_chat == source_chat and pending_msg == source_msg:
+                mapped[dest_chat] = dest_msg
+        
+        # Não devolve ao cache o que foi excluído enquanto a consulta estava em andamento
+        for dest_chat, dest_msg in mapped.items():
+            self.cache.put(source_chat, source_msg, dest_chat, dest_msg, since=generation)
+        return mapped
+
+    async def get_mapped_messages_bulk(self, source_chat: int, source_msgs, dest_chats=None) -> dict:
+        """
+        Recupera os mapeamentos de várias mensagens de uma vez: {source_msg: {dest_chat: dest_msg}}.
+        As mensagens com todos os destinos em cache não vão ao banco; as demais são
+        resolvidas com uma única consulta indexada (dividida em blocos se necessário).
+        """
+        mapped = {}
+        missing = []
+        for source_msg in dict.fromkeys(source_msgs):
+            cached = self.cache.get_many(source_chat, source_msg, dest_chats) if dest_chats else None
+            if cached is not None:
+                mapped[source_msg] = cached
+            else:
+                missing.append(source_msg)
+        
+        if missing:
+            generation = self.cache.generation()
+            found = await self._run_safe(
+                self._get_mapped_messages_bulk, source_chat, missing,
+                error_message="Erro ao recuperar IDs mapeados",
+                default={}
+            )
             
-            # Reconecta ao banco de dados
-            self._connect()
+            # Complementa com os mapeamentos que ainda estão no buffer
+            missing_set = set(missing)
+            for (pending_chat, pending_msg, dest_chat), dest_msg in self._pending.items():
+                if pending_chat == source_chat and pending_msg in missing_set:
+                    found.setdefault(pending_msg, {})[dest_chat] = dest_msg
             
-            removed = count_before - count_after
-            if removed > 0:
-                logger.info(f"Manutenção do DB: {removed} registros antigos removidos")
+            for source_msg, destinations in found.items():
+                for dest_chat, dest_msg in destinations.items():
+                    self.cache.put(source_chat, source_msg, dest_chat, dest_msg, since=generation)
+            mapped.update(found)
+        
+        return mapped
+
+    async def delete_mappings(self, source_chat: int, source_msgs, dest_chat: int = None) -> None:
+        """Remove os mapeamentos de várias mensagens (em um destino ou, se dest_chat for None, em todos) em uma única operação."""
+        source_msgs = list(dict.fromkeys(source_msgs))
+        async with self._flush_lock:
+            source_set = set(source_msgs)
+            for source_msg in source_msgs:
+                self.cache.invalidate(source_chat, source_msg, dest_chat)
+            for key in [key for key in self._pending if key[0] == source_chat and key[1] in source_set]:
+                if dest_chat is None or key[2] == dest_chat:
+                    del self._pending[key]
             
-            logger.info(f"Banco de dados inicializado: {count_after} mapeamentos")
+            await self._run_safe(
+                self._delete_mappings, source_chat, source_msgs, dest_chat,
+                error_message="Erro ao remover mapeamentos"
+            )
+
+    async def delete_mapping(self, source_chat: int, source_msg: int, dest_chat: int = None) -> None:
+        """Remove o mapeamento de uma mensagem em um destino (ou em todos, se dest_chat for None)."""
+        # Usa o lock do flush para que uma gravação em andamento não recrie o mapeamento removido
+        async with self._flush_lock:
+            self.cache.invalidate(source_chat, source_msg, dest_chat)
+            for key in [key for key in self._pending if key[0] == source_chat and key[1] == source_msg]:
+                if dest_chat is None or key[2] == dest_chat:
+                    del self._pending[key]
             
-        except sqlite3.Error as e:
-            logger.error(f"Erro na manutenção do banco de dados: {e}")
-            # Tenta reconectar em caso de erro
-            self._reconnect()
+            await self._run_safe(
+                self._delete_mapping, source_chat, source_msg, dest_chat,
+                error_message="Erro ao remover mapeamento"
+            )
 
-    def insert_message(self, chat_id: int, original_message_id: int, destination_message_id: int) -> None:
-        """Insere um novo mapeamento de mensagem ou atualiza se já existir."""
-        try:
-            self._execute_with_retry('''
-                INSERT OR REPLACE INTO messages 
-                (chat_id, original_message_id, destination_message_id, timestamp)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (chat_id, original_message_id, destination_message_id))
-        except sqlite3.Error as e:
-            logger.error(f"Erro ao inserir mensagem no banco de dados: {e}")
-            self._reconnect()
+    async def add_outbox_jobs(self, source_chat: int, source_msg: int, dest_chats) -> None:
+        """Registra no outbox, antes do envio, um job por destino da mensagem (gravado imediatamente)."""
+        rows = [(source_chat, source_msg, dest_chat) for dest_chat in dest_chats]
+        if rows:
+            await self._run_safe(
+                self._update_outbox_jobs,
+                "INSERT OR IGNORE INTO outbox (source_chat, source_msg, dest_chat) VALUES (?, ?, ?)", rows,
+                error_message="Erro ao registrar envios no outbox"
+            )
 
-    def get_mapped_message_id(self, chat_id: int, original_message_id: int) -> int:
-        """Recupera o ID da mensagem no destino, com base no ID original."""
-        try:
-            cursor = self._execute_with_retry('''
-                SELECT destination_message_id FROM messages
-                WHERE chat_id = ? AND original_message_id = ?
-            ''', (chat_id, original_message_id))
-            
-            result = cursor.fetchone()
-            return result[0] if result else None
-        except sqlite3.Error as e:
-            logger.error(f"Erro ao recuperar ID mapeado: {e}")
-            self._reconnect()
-            return None
+    async def get_outbox_jobs(self) -> list:
+        """Retorna os jobs pendentes do outbox como tuplas (source_chat, source_msg, dest_chat)."""
+        # Grava antes os mapeamentos do buffer, que concluem seus jobs
+        await self.flush()
+        return await self._run_safe(self._get_outbox_jobs, error_message="Erro ao ler o outbox", default=[])
+
+    async def complete_outbox_jobs(self, jobs) -> None:
+        """Remove do outbox os jobs (source_chat, source_msg, dest_chat) informados."""
+        if jobs:
+            await self._run_safe(
+                self._update_outbox_jobs,
+                "DELETE FROM outbox WHERE source_chat = ? AND source_msg = ? AND dest_chat = ?", list(jobs),
+                error_message="Erro ao concluir jobs do outbox"
+            )
+
+    async def mark_outbox_attempt(self, jobs) -> None:
+        """Incrementa o contador de tentativas dos jobs informados."""
+        if jobs:
+            await self._run_safe(
+                self._update_outbox_jobs,
+                "UPDATE outbox SET attempts = attempts + 1 WHERE source_chat = ? AND source_msg = ? AND dest_chat = ?", list(jobs),
+                error_message="Erro ao atualizar tentativas do outbox"
+            )
+
+    async def purge_outbox(self, max_attempts: int) -> int:
+        """Descarta os jobs que já atingiram max_attempts tentativas. Retorna a quantidade removida."""
+        return await self._run_safe(self._purge_outbox, max_attempts, error_message="Erro ao limpar o outbox", default=0)
+
+    async def count_outbox_jobs(self) -> int:
+        """Conta os envios ainda pendentes no outbox."""
+        # Mapeamentos ainda no buffer concluem jobs que continuam na tabela
+        await self.flush()
+        return await self._run_safe(self._count_outbox_jobs, error_message="Erro ao contar jobs do outbox", default=0)
 
-    def delete_mapping(self, chat_id: int, original_message_id: int) -> None:
-        """Remove um mapeamento de mensagem."""
+    async def get_clone_job(self, source_chat: int, dest_chat: int):
+        """Retorna (last_msg, copied, status) do checkpoint da clonagem, ou None se não existir."""
+        return await self._run_safe(self._get_clone_job, source_chat, dest_chat, error_message="Erro ao ler checkpoint da clonagem")
+
+    async def save_clone_job(self, source_chat: int, dest_chat: int, last_msg: int, copied: int, status: str) -> None:
+        """Grava o checkpoint da clonagem de histórico (última mensagem copiada e total)."""
+        await self._run_safe(
+            self._save_clone_job, source_chat, dest_chat, last_msg, copied, status,
+            error_message="Erro ao gravar checkpoint da clonagem"
+        )
+
+    async def list_clone_jobs(self) -> list:
+        """Lista as clonagens registradas (source_chat, dest_chat, last_msg, copied, status, updated_at)."""
+        return await self._run_safe(self._list_clone_jobs, error_message="Erro ao listar clonagens", default=[])
+
+    async def count_mappings(self, since_days: int = None) -> int:
+        """Conta os mapeamentos salvos (opcionalmente apenas os dos últimos since_days dias)."""
+        await self.flush()
+        return await self._run(self._count_mappings, since_days)
+
+    async def run_maintenance(self, days: int = RETENTION_DAYS) -> int:
+        """
+        Remove mapeamentos antigos em lotes pequenos, liberando a thread do banco entre
+        os lotes para que as operações de replicação não fiquem esperando.
+        Não executa VACUUM: o espaço liberado é reaproveitado pelo SQLite.
+        """
+        removed = 0
         try:
-            self._execute_with_retry('''
-                DELETE FROM messages
-                WHERE chat_id = ? AND original_message_id = ?
-            ''', (chat_id, original_message_id))
+            while True:
+                batch_removed = await self._run(self._maintenance_batch, days, MAINTENANCE_BATCH_SIZE)
+                removed += batch_removed
+                if batch_removed < MAINTENANCE_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+            await self._run(self._maintenance_finish)
+            if removed > 0:
+                logger.info(f"Manutenção do DB: {removed} registros antigos removidos")
         except sqlite3.Error as e:
-            logger.error(f"Erro ao remover mapeamento: {e}")
-            self._reconnect()
+            logger.error(f"Erro na manutenção do banco de dados: {e}")
+        return removed
+
+    async def clear_mappings(self, days: int) -> int:
+        """
+        Remove mapeamentos mais antigos que o número de dias informado, nos mesmos lotes
+        da manutenção. Sem VACUUM: em um banco grande ele seguraria a thread do banco
+        (e toda a replicação) por minutos.
+        """
+        removed = 0
+        while True:
+            batch_removed = await self._run(self._maintenance_batch, days, MAINTENANCE_BATCH_SIZE)
+            removed += batch_removed
+            if batch_removed < MAINTENANCE_BATCH_SIZE:
+                break
+            await asyncio.sleep(0)
+        await self._run(self._maintenance_finish)
+        return removed
     
     def close(self):
         """Fecha explicitamente a conexão com o banco de dados."""
+        # Cancela o flush agendado: depois do shutdown do executor ele não conseguiria mais gravar
+        self._cancel_flush_task()
+        # Aguarda as requisições pendentes na thread do banco antes de fechar a conexão
+        executor = getattr(self, '_executor', None)
+        if executor:
+            executor.shutdown(wait=True)
         if self.conn:
             try:
                 self.conn.close()
@@ -165,3 +684,37 @@ class DatabaseManager:
     def __del__(self):
         """Garantir que a conexão seja fechada corretamente."""
         self.close()
+
+# Instância única do banco de dados, compartilhada por todo o processo
+_db_instance = None
+
+def get_db() -> DatabaseManager:
+    """Retorna o DatabaseManager compartilhado, criando-o na primeira chamada."""
+    global _db_instance
+    if _db_instance is None:
+        # A tabela antiga guardava o ID do último destino gravado, que é o último da lista
+        config = get_config()
+        destination_chats = config.get('destination_chats', ())
+        legacy_dest_chat = destination_chats[-1] if destination_chats else None
+        _db_instance = DatabaseManager(
+            legacy_dest_chat=legacy_dest_chat,
+            flush_interval_ms=config.get('db_flush_interval_ms', WRITE_BUFFER_FLUSH_MS),
+            flush_max_rows=config.get('db_flush_max_rows', WRITE_BUFFER_MAX_ROWS),
+            cache_size=config.get('mapping_cache_size', MAPPING_CACHE_SIZE),
+            cache_ttl=config.get('mapping_cache_ttl', MAPPING_CACHE_TTL)
+        )
+    return _db_instance
+
+async def flush_db() -> None:
+    """Grava os mapeamentos pendentes do DatabaseManager compartilhado (usado no encerramento)."""
+    if _db_instance is not None:
+        # O flush final grava tudo; o flush atrasado pendente não é mais necessário
+        _db_instance._cancel_flush_task()
+        await _db_instance.flush()
+
+def close_db() -> None:
+    """Fecha o DatabaseManager compartilhado, se tiver sido criado."""
+    global _db_instance
+    if _db_instance is not None:
+        _db_instance.close()
+        _db_instance = None
@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+
+class MappingCache:
+    """
+    Cache LRU com expiração (TTL) dos mapeamentos recentes
+    (source_chat, source_msg, dest_chat) -> dest_msg.
+
+    Edições e exclusões quase sempre envolvem mensagens dos últimos minutos,
+    então a maior parte das consultas é resolvida aqui sem tocar no SQLite.
+
+    Cada invalidação avança um contador de geração e registra a geração na mensagem
+    de origem. Uma consulta ao banco guarda generation() antes de começar e passa o
+    valor para put(): se a mensagem foi invalidada no meio da consulta, o resultado
+    (anterior à exclusão) não volta para o cache.
+    """
+
+    def __init__(self, max_size: int = 50000, ttl: float = 3600):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self._entries = OrderedDict()  # chave -> (dest_msg, expira_em)
+        self._by_source = {}  # (source_chat, source_msg) -> conjunto de dest_chat em cache
+        self._generation = 0
+        self._invalidated = OrderedDict()  # (source_chat, source_msg) -> geração da última invalidação
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source_chat, source_msg, dest_chat):
+        """Retorna o ID mapeado em cache ou None, contabilizando acerto/falha."""
+        key = (source_chat, source_msg, dest_chat)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        dest_msg, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dest_msg
+
+    def get_many(self, source_chat, source_msg, dest_chats):
+        """Retorna {dest_chat: dest_msg} se todos os destinos estiverem em cache, senão None."""
+        mapped = {}
+        for dest_chat in dest_chats:
+            dest_msg = self.get(source_chat, source_msg, dest_chat)
+            if dest_msg is None:
+                return None
+            mapped[dest_chat] = dest_msg
+        return mapped
+
+    def generation(self):
+        """Retorna a geração atual, a ser guardada antes de uma consulta ao banco."""
+        return self._generation
+
+    def put(self, source_chat, source_msg, dest_chat, dest_msg, since=None):
+        """
+        Adiciona ou atualiza um mapeamento, descartando os menos usados se necessário.
+        Se since (uma generation()) for informado e a mensagem tiver sido invalidada
+        depois dele, o mapeamento está desatualizado e é ignorado.
+        """
+        if since is not None and self._invalidated.get((source_chat, source_msg), -1) > since:
+            return
+        key = (source_chat, source_msg, dest_chat)
+        self._entries[key] = (dest_msg, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        self._by_source.setdefault((source_chat, source_msg), set()).add(dest_chat)
+
+        while len(self._entries) > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    def invalidate(self, source_chat, source_msg, dest_chat=None):
+        """Remove o mapeamento de um destino (ou de todos, se dest_chat for None)."""
+        self._generation += 1
+        source_key = (source_chat, source_msg)
+        self._invalidated[source_key] = self._generation
+        self._invalidated.move_to_end(source_key)
+        while len(self._invalidated) > self.max_size:
+            self._invalidated.popitem(last=False)
+
+        dest_chats = self._by_source.get((source_chat, source_msg))
+        if not dest_chats:
+            return
+        targets = list(dest_chats) if dest_chat is None else [dest_chat]
+        for target in targets:
+            self._remove((source_chat, source_msg, target))
+
+    def _remove(self, key):
+        if self._entries.pop(key, None) is None:
+            return
+        source_key = key[:2]
+        dest_chats = self._by_source.get(source_key)
+        if dest_chats is not None:
+            dest_chats.discard(key[2])
+            if not dest_chats:
+                del self._by_source[source_key]
+
+    def get_stats(self):
+        """Retorna tamanho e contadores de acerto/falha do cache."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
@@ -1,7 +1,9 @@
 import json
 import re
 from telethon import events
-from utils.logger import logger
+from utils.logger import get_logger
+
+logger = get_logger('content_filter')
 
 def safe_text(text):
     """Sanitiza o texto para logging seguro, removendo caracteres problemáticos se necessário."""
@@ -12,6 +14,10 @@ def safe_text(text):
         if isinstance(text, bytes):
             text = text.decode('utf-8')
         
+        # Texto ASCII é sempre válido: evita recodificar o texto inteiro
+        if text.isascii():
+            return text
+        
         # Verifica se o texto é válido em UTF-8
         text.encode('utf-8')
         return text
@@ -27,6 +33,102 @@ def safe_text(text):
         except:
             return "[Texto com caracteres não suportados]"
 
+class SafeText:
+    """
+    Texto para usar como argumento de log: safe_text só é aplicado quando o
+    registro é de fato formatado, e não em mensagens descartadas pelo nível.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return safe_text(self.text)
+
+def _to_text(value):
+    """Garante que palavras e substituições da configuração estejam em formato Unicode."""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+def _build_trie_pattern(words):
+    """
+    Monta uma expressão regular em forma de trie a partir das palavras.
+    Prefixos comuns são compartilhados, então o custo por posição do texto depende
+    do tamanho das palavras e não da quantidade delas; a alternativa mais longa
+    tem preferência quando uma palavra é prefixo de outra.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def to_regex(node):
+        is_end = '' in node
+        branches = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if is_end else group
+
+    return to_regex(trie)
+
+class CompiledFilter:
+    """
+    Filtro de conteúdo pré-compilado a partir de blocked_words e replacements.
+    As palavras bloqueadas viram uma única regex e as substituições são aplicadas
+    todas em uma só passada sobre o texto (sem diferenciar maiúsculas/minúsculas).
+    """
+
+    def __init__(self, blocked_words, replacements):
+        words = {_to_text(word).lower() for word in blocked_words}
+        words.discard('')
+        self._blocked_pattern = re.compile(_build_trie_pattern(words), re.IGNORECASE) if words else None
+
+        self._replacements = {}
+        for original, replacement in replacements.items():
+            original = _to_text(original)
+            if original:
+                self._replacements[original.lower()] = _to_text(replacement)
+        self._replacement_pattern = (
+            re.compile(_build_trie_pattern(self._replacements), re.IGNORECASE) if self._replacements else None
+        )
+
+    def is_blocked(self, text):
+        """Retorna True se o texto contém alguma palavra bloqueada."""
+        return bool(self._blocked_pattern and self._blocked_pattern.search(text))
+
+    def apply_replacements(self, text):
+        """Aplica todas as substituições configuradas ao texto."""
+        if not self._replacement_pattern:
+            return text
+        return self._replacement_pattern.sub(self._replace_match, text)
+
+    def _replace_match(self, match):
+        matched = match.group(0)
+        return self._replacements.get(matched.lower(), matched)
+
+# Filtro compilado para a última versão de configuração vista
+_compiled_filter = None
+_compiled_filter_version = None
+
+def get_compiled_filter(config):
+    """Retorna o filtro compilado, reconstruindo-o apenas quando a versão da configuração muda."""
+    global _compiled_filter, _compiled_filter_version
+    version = getattr(config, 'version', None)
+    if version is None:
+        # Configuração sem versão (dict comum): compila sem guardar em cache
+        return CompiledFilter(config.get('blocked_words', []), config.get('replacements', {}))
+    if _compiled_filter is None or _compiled_filter_version != version:
+        _compiled_filter = CompiledFilter(config.get('blocked_words', []), config.get('replacements', {}))
+        _compiled_filter_version = version
+    return _compiled_filter
+
 async def filter_content(event, config):
     """
     Filtra o conteúdo da mensagem com base nas regras definidas em config.json.
@@ -43,39 +145,23 @@ async def filter_content(event, config):
             text = text.decode('utf-8', errors='replace')
     
     # Log do texto recebido (sanitizado para evitar problemas de codificação)
-    logger.info(f"Texto recebido para filtragem: {safe_text(text)}")
+    logger.debug("Texto recebido para filtragem: %s", SafeText(text))
     
     # Se o texto estiver vazio, retorna como está
     if not text:
         return text
     
-    # Verifica palavras bloqueadas
-    blocked_words = config.get('blocked_words', [])
-    for word in blocked_words:
-        # Garante que a palavra bloqueada está em formato Unicode
-        if isinstance(word, bytes):
-            word = word.decode('utf-8', errors='replace')
-            
-        if word.lower() in text.lower():
-            return None  # Bloqueia a mensagem
+    # Obtém o filtro compilado para a versão atual da configuração
+    compiled_filter = get_compiled_filter(config)
     
-    # Aplica substituições
-    replacements = config.get('replacements', {})
-    # Cria uma cópia do texto original para trabalhar
-    filtered_text = text
+    # Verifica palavras bloqueadas
+    if compiled_filter.is_blocked(text):
+        return None  # Bloqueia a mensagem
     
-    for original, replacement in replacements.items():
-        # Garante que as strings de substituição estão em formato Unicode
-        if isinstance(original, bytes):
-            original = original.decode('utf-8', errors='replace')
-        if isinstance(replacement, bytes):
-            replacement = replacement.decode('utf-8', errors='replace')
-        
-        # Usa regex para substituição case-insensitive
-        pattern = re.compile(re.escape(original), re.IGNORECASE)
-        filtered_text = pattern.sub(replacement, filtered_text)
+    # Aplica todas as substituições em uma única passada
+    filtered_text = compiled_filter.apply_replacements(text)
     
     # Log do texto após as substituições
-    logger.info(f"Texto após substituições: {safe_text(filtered_text)}")
+    logger.debug("Texto após substituições: %s", SafeText(filtered_text))
     
     return filtered_text
@@ -1,11 +1,122 @@
 import json
 import os
-from utils.logger import logger
+import time
+from utils.logger import get_logger
 from utils.resource_handler import get_media_dir, load_config
 
+logger = get_logger('media_replacer')
+
 # Diretório para armazenar as mídias de substituição
 MEDIA_DIR = get_media_dir()
 
+# Extensões aceitas para stickers, em ordem de preferência
+STICKER_EXTENSIONS = ('.webp', '.webm', '.tgs')
+
+# Tipo MIME de cada extensão de mídia de substituição
+MEDIA_MIME_TYPES = {
+    '.webp': 'image/webp',
+    '.webm': 'video/webm',
+    '.tgs': 'application/x-tgsticker',
+    '.jpg': 'image/jpeg',
+}
+
+# Intervalo mínimo (s) entre verificações do diretório de mídia por alterações externas
+MEDIA_INDEX_CHECK_INTERVAL = 5.0
+
+class MediaIndex:
+    """
+    Índice em memória dos arquivos de MEDIA_DIR: nome do arquivo sem extensão
+    (ex.: "sticker_123") -> {extensão: (caminho, tipo MIME, stat)}.
+
+    O índice é montado uma vez e reconstruído quando invalidado pelos comandos
+    que salvam mídias ou quando o mtime do diretório muda (arquivos adicionados
+    ou removidos manualmente). Essa verificação custa um único stat a cada
+    MEDIA_INDEX_CHECK_INTERVAL segundos, em vez de vários stats por mensagem.
+
+    O stat de cada arquivo fica guardado no índice e é usado pelo cache de uploads
+    sem novas consultas ao disco. Sobrescrever um arquivo no lugar não muda o mtime
+    do diretório; nesse caso o stat só é refeito (refresh_stat) quando o handle
+    salvo no cache de uploads é recusado pelo Telegram.
+    """
+
+    def __init__(self, media_dir):
+        self.media_dir = media_dir
+        self._entries = None
+        self._stats = {}  # caminho -> os.stat_result
+        self._dir_mtime = None
+        self._last_check = 0.0
+
+    def invalidate(self):
+        """Força a reconstrução do índice na próxima consulta."""
+        self._entries = None
+
+    def _rebuild(self):
+        entries = {}
+        stats = {}
+        try:
+            self._dir_mtime = os.stat(self.media_dir).st_mtime_ns
+            with os.scandir(self.media_dir) as it:
+                for entry in it:
+                    if not entry.is_file():
+                        continue
+                    stem, extension = os.path.splitext(entry.name)
+                    extension = extension.lower()
+                    if extension not in MEDIA_MIME_TYPES:
+                        continue
+                    file_stat = entry.stat()
+                    entries.setdefault(stem, {})[extension] = (entry.path, MEDIA_MIME_TYPES[extension])
+                    stats[entry.path] = file_stat
+        except Exception as e:
+            logger.error("Erro ao indexar diretório de mídia: %s", e)
+        self._entries = entries
+        self._stats = stats
+        logger.debug("Índice de mídias reconstruído: %s arquivos", len(stats))
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._entries is not None and now - self._last_check < MEDIA_INDEX_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        if self._entries is not None:
+            try:
+                if os.stat(self.media_dir).st_mtime_ns == self._dir_mtime:
+                    return
+            except OSError:
+                pass
+        self._rebuild()
+
+    def find(self, stem, extensions):
+        """Retorna (caminho, tipo MIME) do primeiro arquivo existente entre as extensões, ou None."""
+        self._ensure_fresh()
+        files = self._entries.get(stem)
+        if not files:
+            return None
+        for extension in extensions:
+            if extension in files:
+                return files[extension]
+        return None
+
+    def get_stat(self, path):
+        """Retorna o stat do arquivo guardado no índice, ou None se não estiver indexado."""
+        return self._stats.get(path)
+
+    def refresh_stat(self, path):
+        """Refaz o stat do arquivo e atualiza o índice. Retorna None se o arquivo não existir mais."""
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            self._stats.pop(path, None)
+            return None
+        self._stats[path] = file_stat
+        return file_stat
+
+# Índice global das mídias de substituição
+media_index = MediaIndex(MEDIA_DIR)
+
+def invalidate_media_index():
+    """Deve ser chamado sempre que um arquivo de MEDIA_DIR for criado, alterado ou removido."""
+    media_index.invalidate()
+
 async def replace_media(event, config):
     try:
         # Verifica se a mensagem contém mídia
@@ -25,21 +136,16 @@ async def replace_media(event, config):
                 if not custom_id.startswith("sticker_"):
                     custom_id = f"sticker_{custom_id}"
                 
-                # Verifica extensões possíveis para stickers usando o caminho correto
-                possible_paths = [
-                    os.path.join(MEDIA_DIR, f"{custom_id}.webp"),  # Formato standard sticker
-                    os.path.join(MEDIA_DIR, f"{custom_id}.webm"),  # Formato vídeo sticker
-                    os.path.join(MEDIA_DIR, f"{custom_id}.tgs")    # Formato animado sticker
-                ]
-                
-                # Procura o arquivo em todas as extensões possíveis
-                for replacement_path in possible_paths:
-                    if os.path.exists(replacement_path):
-                        # Simplificando o log para conter apenas o ID e não o caminho completo
-                        logger.info(f"Sticker substituído: {sticker_id} -> {os.path.basename(replacement_path)}")
-                        return replacement_path
+                # Procura o arquivo no índice em todas as extensões possíveis
+                # (.webp standard, .webm vídeo, .tgs animado)
+                found = media_index.find(custom_id, STICKER_EXTENSIONS)
+                if found:
+                    replacement_path, mime_type = found
+                    # Simplificando o log para conter apenas o ID e não o caminho completo
+                    logger.info("Sticker substituído: %s -> %s", sticker_id, os.path.basename(replacement_path))
+                    return replacement_path
                 
-                logger.warning(f"Arquivo de substituição não encontrado para sticker {sticker_id}")
+                logger.warning("Arquivo de substituição não encontrado para sticker %s", sticker_id)
         
         # Identifica imagens para substituição
         elif event.photo:
@@ -47,18 +153,19 @@ async def replace_media(event, config):
             image_replacements = config.get('image_replacements', {})
             
             if photo_id in image_replacements:
-                # Caminho do arquivo local de substituição
-                replacement_path = os.path.join(MEDIA_DIR, f"image_{image_replacements[photo_id]}.jpg")
+                # Procura o arquivo local de substituição no índice
+                custom_id = f"image_{image_replacements[photo_id]}"
+                found = media_index.find(custom_id, ('.jpg',))
                 
-                # Verifica se o arquivo de substituição existe
-                if os.path.exists(replacement_path):
-                    logger.info(f"Imagem substituída: {photo_id} -> {replacement_path}")
+                if found:
+                    replacement_path, mime_type = found
+                    logger.info("Imagem substituída: %s -> %s", photo_id, replacement_path)
                     return replacement_path
                 else:
-                    logger.warning(f"Arquivo de substituição não encontrado: {replacement_path}")
+                    logger.warning("Arquivo de substituição não encontrado: %s", os.path.join(MEDIA_DIR, custom_id + '.jpg'))
         
         return None
 
     except Exception as e:
-        logger.error(f"Erro ao substituir mídia: {e}", exc_info=True)
+        logger.error("Erro ao substituir mídia: %s", e, exc_info=True)
         return None
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from database.db_manager import get_db
+from handlers.message_handler import replicate_message
+from utils.dispatcher import dispatcher
+from utils.logger import logger
+from utils.rate_limiter import rate_limiter
+from utils.resource_handler import get_config, is_limit_reached, increment_action_count
+from utils.scheduler import get_is_active_status
+
+# Teto padrão de mensagens reenviadas por segundo durante o backfill
+DEFAULT_BACKFILL_MAX_PER_SEC = 5
+# Máximo padrão de mensagens recuperadas por chat em um backfill
+DEFAULT_BACKFILL_MAX_MESSAGES = 5000
+# Mensagens enviadas para a fila de entrada de cada vez
+BACKFILL_BATCH_SIZE = 50
+
+# Chats de origem com backfill em andamento
+_running = set()
+
+async def run_backfill(client, watermarks):
+    """
+    Recupera as mensagens perdidas de todos os chats de origem (na inicialização ou ao ativar o bot).
+
+    watermarks é a cópia de get_db().get_source_watermarks() tirada antes de as mensagens
+    ao vivo voltarem a ser processadas: a primeira mensagem ao vivo avança o estado do
+    chat e esconderia o intervalo perdido.
+    """
+    if not get_is_active_status():
+        logger.info("[BACKFILL] Bot inativo, backfill adiado até a próxima ativação")
+        return 0
+
+    config = get_config()
+    total = 0
+    for source_chat in config['source_chats']:
+        total += await backfill_source(client, source_chat, watermarks.get(source_chat), config)
+    return total
+
+async def backfill_source(client, source_chat, since_id, config=None):
+    """
+    Reenvia, pelo pipeline normal, as mensagens do chat de origem entre since_id e a
+    mensagem mais recente no início do backfill (as posteriores chegam ao vivo).
+    Retorna a quantidade de mensagens reenviadas.
+
+    As mensagens recuperadas entram na fila de entrada do chat depois das que já
+    chegaram ao vivo, então nos destinos podem aparecer depois de mensagens mais novas.
+    """
+    if source_chat in _running:
+        return 0
+    _running.add(source_chat)
+
+    try:
+        config = config or get_config()
+        db = get_db()
+
+        latest = await rate_limiter.run(source_chat, client.get_messages, source_chat, limit=1)
+        if since_id is None:
+            # Primeira execução para este chat: apenas registra o ponto de partida
+            if latest:
+                await db.note_source_message(source_chat, latest[0].id)
+            return 0
+        if not latest or latest[0].id <= since_id:
+            return 0
+
+        max_per_sec = max(0.1, float(config.get('backfill_max_per_sec', DEFAULT_BACKFILL_MAX_PER_SEC)))
+        max_messages = int(config.get('backfill_max_messages', DEFAULT_BACKFILL_MAX_MESSAGES))
+        dest_chats = list(config['destination_chats'])
+
+        started = time.monotonic()
+        replayed = 0
+        fetched = 0
+        batch = []
+        async for message in rate_limiter.iter_history(client, source_chat, min_id=since_id, max_id=latest[0].id + 1, limit=max_messages):
+            fetched += 1
+            # Mensagens de serviço (entrada de membros, fixação, etc.) não são replicadas
+            if getattr(message, 'action', None):
+                continue
+            batch.append(message)
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                replayed += await _replay_batch(source_chat, batch, dest_chats, max_per_sec)
+                batch = []
+                if is_limit_reached():
+                    logger.error("[BACKFILL] Limite de ações atingido. Backfill interrompido.")
+                    return replayed
+        if batch:
+            replayed += await _replay_batch(source_chat, batch, dest_chats, max_per_sec)
+
+        if fetched >= max_messages:
+            logger.warning(f"[BACKFILL] Chat {source_chat}: limite de {max_messages} mensagens atingido; mensagens mais recentes podem ter ficado de fora")
+        if replayed:
+            elapsed = time.monotonic() - started
+            logger.info(f"[BACKFILL] Chat {source_chat}: {replayed} mensagens recuperadas em {elapsed:.1f}s")
+        return replayed
+
+    except Exception as e:
+        logger.error(f"[BACKFILL] Erro no backfill do chat {source_chat}: {e}", exc_info=True)
+        return 0
+    finally:
+        _running.discard(source_chat)
+
+async def _replay_batch(source_chat, batch, dest_chats, max_per_sec):
+    """Envia um lote pela fila de entrada do chat, respeitando o teto de vazão."""
+    started = time.monotonic()
+    mapped = await get_db().get_mapped_messages_bulk(source_chat, [message.id for message in batch], dest_chats)
+
+    futures = []
+    for message in batch:
+        # Destinos que já têm a mensagem (ex.: recebida antes da queda) não são reenviados
+        missing = [dest for dest in dest_chats if dest not in mapped.get(message.id, {})]
+        if not missing:
+            continue
+        if not increment_action_count():
+            break
+        futures.append(dispatcher.submit(source_chat, None, replicate_message, message, missing))
+    await asyncio.gather(*futures)
+
+    # Espaça os lotes para não passar de max_per_sec mensagens por segundo
+    min_duration = len(futures) / max_per_sec
+    elapsed = time.monotonic() - started
+    if elapsed < min_duration:
+        await asyncio.sleep(min_duration - elapsed)
+    return len(futures)
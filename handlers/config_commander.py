@@ -1,7 +1,10 @@
 from telethon import events
 from utils.logger import logger
 from utils.scheduler import reload_scheduler
-from utils.resource_handler import get_config_path, load_config, save_config
+from utils.resource_handler import get_config_path, get_config, load_config, save_config
+from database.db_manager import get_db
+from handlers.history_cloner import clone_history, is_clone_running, parse_chat_ref
+import asyncio
 import json
 import os
 import re
@@ -13,7 +16,12 @@ CONFIG_PATH = get_config_path()
 # Lista de comandos administrativos que sempre funcionam
 ADMIN_COMMANDS = ['/help', '/status', '/config', '/block', '/unblock', '/blocklist', 
                  '/replace', '/unreplace', '/replacelist', '/schedule', '/settime', 
-                 '/showschedule', '/deletestatus', '/clearmappings', '/textoonly']
+                 '/showschedule', '/deletestatus', '/clearmappings', '/textoonly',
+                 '/clonehistory']
+
+def _is_owner_command(event):
+    """Comandos que disparam tarefas longas só valem para mensagens da própria conta ou do chat de administração."""
+    return bool(event.out) or event.chat_id == get_config().get('chat_id')
 
 async def handle_config_commands(event):
     """
@@ -35,6 +43,9 @@ async def handle_config_commands(event):
     
     /textoonly on/off - Ativa/desativa replicação apenas de texto
     
+    /clonehistory [origem] [destino] - Copia todo o histórico da origem para o destino
+    /clonehistory - Mostra o progresso das clonagens
+    
     /config - Mostra todas as configurações
     """
     try:
@@ -392,16 +403,16 @@ async def handle_config_commands(event):
         elif command_name == "/deletestatus":
             try:
                 # Obtém estatísticas do banco de dados
-                from database.db_manager import DatabaseManager
-                db = DatabaseManager()
+                db = get_db()
                 
                 # Obtém contagem de mapeamentos
-                cursor = db.conn.execute("SELECT COUNT(*) FROM messages")
-                total_mappings = cursor.fetchone()[0]
+                total_mappings = await db.count_mappings()
                 
                 # Obtém contagem dos últimos dias
-                cursor = db.conn.execute("SELECT COUNT(*) FROM messages WHERE timestamp > datetime('now', '-1 day')")
-                recent_mappings = cursor.fetchone()[0]
+                recent_mappings = await db.count_mappings(since_days=1)
+                
+                # Estatísticas do cache de mapeamentos recentes
+                cache_stats = db.cache.get_stats()
                 
                 status_message = f"""
 📊 **Status de Sincronização de Deleções:**
@@ -409,6 +420,11 @@ async def handle_config_commands(event):
 • Total de mapeamentos: {total_mappings}
 • Mapeamentos recentes (24h): {recent_mappings}
 
+⚡ **Cache de mapeamentos:**
+• Entradas: {cache_stats['size']}/{cache_stats['max_size']}
+• Acertos: {cache_stats['hits']} | Falhas: {cache_stats['misses']}
+• Taxa de acerto: {cache_stats['hit_rate']:.1%}
+
 ℹ️ **Como funciona:**
 O sistema de deleção sincronizada depende do mapeamento entre mensagens originais e replicadas.
 Quando uma mensagem é apagada no grupo de origem, o bot procura seu ID correspondente no banco 
@@ -439,26 +455,13 @@ de dados e tenta apagá-la no grupo de destino.
                     return
                 
                 # Limpa mapeamentos mais antigos que o número especificado de dias
-                from database.db_manager import DatabaseManager
-                db = DatabaseManager()
-                
-                # Obtém contagem antes da limpeza
-                cursor = db.conn.execute("SELECT COUNT(*) FROM messages")
-                before_count = cursor.fetchone()[0]
+                db = get_db()
                 
-                # Executa a limpeza
-                db.conn.execute(f"DELETE FROM messages WHERE timestamp < datetime('now', '-{days} day')")
-                db.conn.commit()
+                # Executa a limpeza em lotes na thread do banco, sem bloquear a replicação
+                removed = await db.clear_mappings(days)
                 
                 # Obtém contagem após a limpeza
-                cursor = db.conn.execute("SELECT COUNT(*) FROM messages")
-                after_count = cursor.fetchone()[0]
-                
-                # Otimiza o banco
-                db.conn.execute("VACUUM")
-                db.conn.commit()
-                
-                removed = before_count - after_count
+                after_count = await db.count_mappings()
                 
                 await event.respond(f"✅ Limpeza concluída:\n• Mapeamentos removidos: {removed}\n• Mapeamentos restantes: {after_count}")
                 
@@ -469,6 +472,54 @@ de dados e tenta apagá-la no grupo de destino.
                 await event.respond(f"❌ Erro ao limpar mapeamentos: {e}")
             
             return
+        
+        # ----- CLONAGEM DE HISTÓRICO -----
+        
+        # Ignora /clonehistory vindo de qualquer outro chat ou remetente
+        elif command_name == "/clonehistory" and not _is_owner_command(event):
+            logger.warning(f"/clonehistory ignorado: enviado no chat {event.chat_id} por {event.sender_id}")
+            return
+        
+        # Inicia (ou retoma) a cópia do histórico de um chat para outro
+        elif command_name == "/clonehistory" and len(command_parts) > 2:
+            source_chat = parse_chat_ref(command_parts[1])
+            dest_chat = parse_chat_ref(command_parts[2])
+            
+            if is_clone_running(source_chat, dest_chat):
+                await event.respond("⚠️ Já existe uma clonagem em andamento para esse par de chats.")
+                return
+            
+            status_msg = await event.respond(f"⏳ Iniciando clonagem de {source_chat} para {dest_chat}...")
+            
+            async def report_progress(text):
+                # Atualiza a mesma mensagem em vez de enviar uma nova a cada relatório
+                try:
+                    await status_msg.edit(text)
+                except Exception as e:
+                    logger.warning(f"Não foi possível atualizar o progresso da clonagem: {e}")
+            
+            # A clonagem pode levar horas: roda em segundo plano sem travar os comandos
+            asyncio.create_task(clone_history(event.client, source_chat, dest_chat, report_progress))
+            return
+        
+        # Lista as clonagens registradas e seu progresso
+        elif command_name == "/clonehistory":
+            jobs = await get_db().list_clone_jobs()
+            if not jobs:
+                await event.respond("ℹ️ Nenhuma clonagem registrada.\nUse: /clonehistory [origem] [destino]")
+                return
+            
+            status_labels = {'running': '⏳ incompleta', 'done': '✅ concluída'}
+            lines = ["📚 **Clonagens de histórico:**\n"]
+            for source_chat, dest_chat, last_msg, copied, status, updated_at in jobs:
+                if is_clone_running(source_chat, dest_chat):
+                    label = '🔄 em andamento'
+                else:
+                    label = status_labels.get(status, status)
+                lines.append(f"• {source_chat} → {dest_chat}: {label}, {copied} mensagens (última: {last_msg}, atualizada em {updated_at} UTC)")
+            
+            await event.respond("\n".join(lines))
+            return
             
     except Exception as e:
         logger.error(f"Erro ao processar comando de configuração: {e}", exc_info=True)
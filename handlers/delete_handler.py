@@ -1,21 +1,25 @@
 # handlers/delete_handler.py
 from telethon import events
-from database.db_manager import DatabaseManager
-from utils.logger import logger
-import json
+from database.db_manager import get_db
+from utils.logger import get_logger, log_replication_event
+from utils.dispatcher import dispatcher
+from utils.rate_limiter import rate_limiter
+from utils.resource_handler import get_config
+from handlers.message_handler import flush_pending_albums
 import asyncio
 import time
 
-db = DatabaseManager()
-# Adiciona semáforo para evitar processamento concorrente de exclusões
-delete_semaphore = asyncio.Semaphore(1)
+logger = get_logger('delete_handler')
+
+# Máximo de IDs aceitos pelo Telegram em uma única chamada de delete_messages
+DELETE_CHUNK_SIZE = 100
 
 # Deleta imediatamente sem criar tarefa separada
 async def handle_delete(event: events.MessageDeleted.Event):
     """Exclui mensagens no destino quando deletadas na origem."""
     # Captura o momento exato do evento
     event_time = time.time()
-    logger.info(f"[{event_time:.6f}] Evento de exclusão detectado no chat {event.chat_id}")
+    logger.info("[%.6f] Evento de exclusão detectado no chat %s", event_time, event.chat_id)
     
     # Se não houver IDs para excluir, retornamos imediatamente
     if not event.deleted_ids:
@@ -23,84 +27,76 @@ async def handle_delete(event: events.MessageDeleted.Event):
         return
         
     # Logamos os IDs que serão excluídos
-    logger.info(f"Detectadas {len(event.deleted_ids)} mensagens excluídas: {event.deleted_ids}")
+    logger.info("Detectadas %s mensagens excluídas: %s", len(event.deleted_ids), event.deleted_ids)
     
-    # Força o loop a processar esta tarefa imediatamente
-    # Executa o código de exclusão com alta prioridade
-    await asyncio.sleep(0)  # Força o evento loop a processar operações pendentes
-    await force_instant_deletion(event.client, event.chat_id, event.deleted_ids)
+    await force_instant_deletion(event.client, event.chat_id, event.deleted_ids, getattr(event, 'received_at', None))
 
-# Força o processamento imediato do evento sem esperar pelo próximo ciclo
-async def force_instant_deletion(client, chat_id, message_ids):
-    # Usa o semáforo para garantir exclusividade
-    async with delete_semaphore:
-        try:
-            start_time = time.time()
-            logger.info(f"[INSTANT DELETE] Iniciando exclusão forçada: {message_ids} do chat {chat_id}")
-            
-            # Força sincronização
-            await asyncio.sleep(0)
-            
-            # Carrega configurações
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-                
-            # Mantém contagem das mensagens excluídas com sucesso
-            success_count = 0
-            not_found_count = 0
-            error_count = 0
-            
-            # Processa as exclusões com prioridade absoluta
-            for original_id in message_ids:
-                # Pausa outras tarefas para maximizar prioridade
-                await asyncio.sleep(0)
-                
-                # Busca o ID correspondente no destino
-                destination_id = db.get_mapped_message_id(chat_id, original_id)
-                    
-                if not destination_id:
-                    not_found_count += 1
-                    logger.warning(f"[INSTANT DELETE] ID {original_id} não encontrado no banco de dados")
-                    continue
-                    
-                logger.info(f"[INSTANT DELETE] ID {original_id} mapeado para ID {destination_id} no destino")
-                
-                # Força mais uma sincronização antes da exclusão
-                await asyncio.sleep(0)
-                
-                # Exclui a mensagem em cada chat de destino
-                for dest_chat in config['destination_chats']:
-                    # Deleta a mensagem imediatamente (sem criar tasks)
-                    start = time.time()
-                    try:
-                        await client.delete_messages(dest_chat, destination_id)
-                        end = time.time()
-                        logger.info(f"[INSTANT DELETE] Mensagem {destination_id} excluída no chat {dest_chat} em {end-start:.3f}s")
-                        success_count += 1
-                    except Exception as e:
-                        error_count += 1
-                        logger.error(f"[INSTANT DELETE] Erro ao excluir mensagem {original_id} no destino {dest_chat}: {e}")
-                    
-                    # Remove o mapeamento após exclusão bem-sucedida
-                    db.delete_mapping(chat_id, original_id)
-            
-            # Garante que o evento foi concluído antes de liberar o lock
-            await asyncio.sleep(0)
-            
-            # Log resumido da operação
-            end_time = time.time()
-            total_time = end_time - start_time
-            logger.info(f"[INSTANT DELETE] Operação de exclusão concluída em {total_time:.3f}s")
+async def force_instant_deletion(client, chat_id, message_ids, received_at=None):
+    """
+    Exclui as mensagens replicadas em todos os destinos. Roda na pista de entrada do
+    chat e só captura os IDs: a exclusão em cada destino é enfileirada na pista desse
+    destino, depois dos envios já enfileirados (inclusive os das mensagens excluídas).
+    Assim um destino lento ou em FloodWait não segura os novos eventos do chat nem os
+    outros destinos.
+    """
+    try:
+        logger.info("[INSTANT DELETE] Iniciando exclusão forçada: %s do chat %s", message_ids, chat_id)
+        
+        # Obtém o snapshot das configurações
+        config = get_config()
+        message_ids = list(dict.fromkeys(message_ids))
+        
+        # Envia os álbuns ainda na janela de espera, para que entrem nas filas de destino antes da exclusão
+        await flush_pending_albums(chat_id)
+        
+        for dest_chat in config['destination_chats']:
+            dispatcher.submit(chat_id, dest_chat, _delete_in_destination, client, chat_id, dest_chat, message_ids, received_at)
             
-            if success_count > 0:
-                logger.info(f"[INSTANT DELETE] {success_count} mensagens excluídas com sucesso")
-            if not_found_count > 0:
-                logger.warning(f"[INSTANT DELETE] {not_found_count} mensagens não encontradas no banco")
-            if error_count > 0:
-                logger.error(f"[INSTANT DELETE] Falha ao excluir {error_count} mensagens")
-                
+    except Exception as e:
+        logger.error("[INSTANT DELETE] Erro crítico durante exclusão instantânea: %s", e, exc_info=True)
+
+async def _delete_in_destination(client, chat_id, dest_chat, message_ids, received_at=None):
+    """
+    Exclui as mensagens em um chat de destino (job da pista do destino): resolve os IDs
+    com uma única consulta, faz uma chamada de delete_messages por bloco de até 100 IDs
+    e remove os mapeamentos. Retorna (excluídas, falhas).
+    """
+    start_time = time.time()
+    mapped = await get_db().get_mapped_messages_bulk(chat_id, message_ids, [dest_chat])
+    id_pairs = [
+        (original_id, mapped[original_id][dest_chat])
+        for original_id in message_ids if dest_chat in mapped.get(original_id, {})
+    ]
+    
+    if len(id_pairs) < len(message_ids):
+        found = {original_id for original_id, _ in id_pairs}
+        missing = [original_id for original_id in message_ids if original_id not in found]
+        logger.warning("[INSTANT DELETE] IDs %s não encontrados no banco de dados para o destino %s", missing, dest_chat)
+        for original_id in missing:
+            log_replication_event('delete', chat_id, original_id, dest_chat, 'not_found', received_at=received_at)
+    
+    deleted = 0
+    failed = 0
+    for i in range(0, len(id_pairs), DELETE_CHUNK_SIZE):
+        pairs = id_pairs[i:i + DELETE_CHUNK_SIZE]
+        chunk = [destination_id for _, destination_id in pairs]
+        start = time.time()
+        try:
+            await rate_limiter.run(dest_chat, client.delete_messages, dest_chat, chunk)
+            deleted += len(chunk)
+            logger.info("[INSTANT DELETE] %s mensagens excluídas no chat %s em %.3fs", len(chunk), dest_chat, time.time() - start)
+            outcome, extra = 'ok', {}
         except Exception as e:
-            logger.error(f"[INSTANT DELETE] Erro crítico durante exclusão instantânea: {e}", exc_info=True)
-        
-        # Espera processamento final antes de retornar
-        await asyncio.sleep(0.05)
\ No newline at end of file
+            failed += len(chunk)
+            logger.error("[INSTANT DELETE] Erro ao excluir mensagens %s no destino %s: %s", chunk, dest_chat, e)
+            outcome, extra = 'failed', {"error": str(e)}
+        for original_id, destination_id in pairs:
+            log_replication_event('delete', chat_id, original_id, dest_chat, outcome,
+                                  dest_msg=destination_id, received_at=received_at, **extra)
+    
+    # Remove os mapeamentos das mensagens processadas neste destino
+    if id_pairs:
+        await get_db().delete_mappings(chat_id, [original_id for original_id, _ in id_pairs], dest_chat)
+        logger.info("[INSTANT DELETE] Destino %s concluído em %.3fs: %s excluídas, %s falhas",
+                    dest_chat, time.time() - start_time, deleted, failed)
+    return deleted, failed
@@ -1,49 +1,67 @@
-from telethon import events
-from database.db_manager import DatabaseManager
-from utils.logger import logger
-import json
-
-db = DatabaseManager()
+from telethon import events, errors
+from database.db_manager import get_db
+from utils.logger import logger, log_replication_event
+from utils.dispatcher import dispatcher
+from utils.rate_limiter import rate_limiter
+from utils.resource_handler import get_config
+from handlers.message_handler import flush_pending_albums
 
 async def handle_edit(event):
     try:
-        # Carrega configurações para obter chats de destino
-        with open('config.json', 'r') as f:
-            config = json.load(f)
-        
+        # Obtém o snapshot das configurações para os chats de destino
+        config = get_config()
+
         # Obtém o mapeamento de IDs da mensagem
         original_id = event.id
         if not original_id:
             logger.warning("Nenhuma mensagem original encontrada para edição.")
             return
 
-        # Obtém ID da mensagem no chat de destino
-        mapped_id = db.get_mapped_message_id(event.chat_id, original_id)
-
-        if not mapped_id:
-            logger.warning(f"Mensagem editada não encontrada no banco: {original_id}")
-            return
+        # Álbuns ainda na janela de espera são enviados antes, para que a mensagem exista no destino
+        await flush_pending_albums(event.chat_id)
 
         # Obtém o texto atualizado
         new_text = event.raw_text
 
-        # Para cada chat de destino, atualiza a mensagem usando o ID mapeado
-        success_count = 0
+        # Enfileira a edição na fila de cada destino, para que ela só rode depois
+        # do envio (e do mapeamento) da mensagem original naquele destino
         for dest_chat in config['destination_chats']:
-            try:
-                # Edita a mensagem no chat de destino (não no chat original)
-                await event.client.edit_message(
-                    entity=dest_chat,  # Corrige para usar o chat de destino
-                    message=mapped_id,
-                    text=new_text
-                )
-                success_count += 1
-                logger.info(f"Mensagem {original_id} editada no destino {dest_chat} (ID: {mapped_id})")
-            except Exception as e:
-                logger.error(f"Erro ao editar mensagem {mapped_id} no chat {dest_chat}: {e}")
-        
-        if success_count > 0:
-            logger.info(f"Mensagem editada com sucesso em {success_count} chat(s) de destino")
+            dispatcher.submit(
+                event.chat_id, dest_chat,
+                rate_limiter.run, dest_chat, _edit_in_destination, event, dest_chat, original_id, new_text
+            )
 
     except Exception as e:
         logger.error(f"Erro ao sincronizar edição: {e}", exc_info=True)
+
+async def _edit_in_destination(event, dest_chat, original_id, new_text):
+    """Edita a mensagem mapeada em um único chat de destino."""
+    # Obtém ID da mensagem no chat de destino
+    mapped_id = await get_db().get_mapped_message_id(event.chat_id, original_id, dest_chat)
+    size = len((new_text or "").encode('utf-8'))
+    received_at = getattr(event, 'received_at', None)
+
+    if not mapped_id:
+        logger.warning(f"Mensagem editada não encontrada no banco: {original_id}")
+        log_replication_event('edit', event.chat_id, original_id, dest_chat, 'not_found', size=size, received_at=received_at)
+        return False
+
+    try:
+        # Edita a mensagem no chat de destino (não no chat original)
+        await event.client.edit_message(
+            entity=dest_chat,  # Corrige para usar o chat de destino
+            message=mapped_id,
+            text=new_text
+        )
+        logger.info(f"Mensagem {original_id} editada no destino {dest_chat} (ID: {mapped_id})")
+        log_replication_event('edit', event.chat_id, original_id, dest_chat, 'ok',
+                              dest_msg=mapped_id, size=size, received_at=received_at)
+        return True
+    except errors.FloodWaitError:
+        # Tratado pelo limitador, que adia e repete a edição
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao editar mensagem {mapped_id} no chat {dest_chat}: {e}")
+        log_replication_event('edit', event.chat_id, original_id, dest_chat, 'failed',
+                              dest_msg=mapped_id, size=size, received_at=received_at, error=str(e))
+        return False
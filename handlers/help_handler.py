@@ -27,6 +27,8 @@ async def handle_help_command(event):
 🔄 **Comandos de Sincronização:**
 • `/deletestatus` - Verifica o status da sincronização de deleções
 • `/clearmappings [dias]` - Limpa mapeamentos mais antigos que o número de dias especificado
+• `/clonehistory [origem] [destino]` - Copia todo o histórico da origem para o destino (retoma de onde parou)
+• `/clonehistory` - Mostra o progresso das clonagens
 
 ⏰ **Comandos de Agendamento:**
 • `/schedule on/off` - Ativa/desativa o agendamento
@@ -0,0 +1,153 @@
+import time
+from database.db_manager import get_db
+from handlers.message_handler import replicate_message, flush_pending_albums
+from utils.dispatcher import dispatcher
+from utils.logger import logger
+from utils.rate_limiter import rate_limiter
+from utils.resource_handler import get_config, is_limit_reached, increment_action_count
+
+# Mensagens buscadas e enfileiradas por lote (o checkpoint é gravado a cada lote)
+CLONE_BATCH_SIZE = 100
+# Intervalo (s) entre os relatórios de progresso
+CLONE_PROGRESS_INTERVAL = 30
+
+# Clonagens em andamento: (source_chat, dest_chat)
+_active_clones = set()
+
+def parse_chat_ref(value):
+    """Converte o argumento do comando em ID numérico do chat (ou mantém o @username)."""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def is_clone_running(source_chat, dest_chat):
+    return (source_chat, dest_chat) in _active_clones
+
+async def clone_history(client, source_chat, dest_chat, progress_callback=None):
+    """
+    Copia todo o histórico de source_chat para dest_chat, da mensagem mais antiga
+    para a mais recente, pelo mesmo pipeline das mensagens novas (filtros,
+    substituições e mapeamentos).
+
+    O progresso é gravado em clone_jobs a cada lote; uma nova execução para o
+    mesmo par continua a partir da última mensagem confirmada. Enquanto um lote
+    é enviado pela fila do destino, o próximo já é buscado e preparado.
+
+    progress_callback(texto) é chamada periodicamente e ao final. Retorna a
+    quantidade de mensagens copiadas nesta execução.
+    """
+    key = (source_chat, dest_chat)
+    if key in _active_clones:
+        raise RuntimeError(f"Já existe uma clonagem em andamento de {source_chat} para {dest_chat}")
+    _active_clones.add(key)
+
+    db = get_db()
+    copied_now = 0
+    try:
+        # IDs numéricos são usados como chave do checkpoint e dos mapeamentos
+        source_id = (await client.get_peer_id(source_chat))
+        dest_id = (await client.get_peer_id(dest_chat))
+        config = get_config()
+
+        checkpoint = await db.get_clone_job(source_id, dest_id)
+        last_msg, copied_total = (checkpoint[0], checkpoint[1]) if checkpoint else (0, 0)
+        if last_msg:
+            logger.info(f"[CLONE] Retomando clonagem {source_id} -> {dest_id} a partir da mensagem {last_msg}")
+        await db.save_clone_job(source_id, dest_id, last_msg, copied_total, 'running')
+
+        started = time.monotonic()
+        last_report = started
+        previous = None  # (distribuição, última mensagem, enviadas, processadas) do lote em envio
+        batch = []
+
+        async def submit_batch(batch):
+            """Enfileira o lote e grava o checkpoint do lote anterior, já enviado."""
+            nonlocal previous
+            mapped = await db.get_mapped_messages_bulk(source_id, [message.id for message in batch], [dest_id])
+            count = 0
+            processed = 0
+            batch_last = None
+            for message in batch:
+                # Mensagens já copiadas (ex.: antes de uma interrupção) não são reenviadas
+                if dest_id not in mapped.get(message.id, {}):
+                    if not increment_action_count():
+                        break
+                    dispatcher.submit(source_id, None, replicate_message, message, [dest_id], config)
+                    count += 1
+                processed += 1
+                batch_last = message.id
+
+            # Os lotes nunca dividem um álbum, então o álbum final já pode ser enviado.
+            # Quando este job da fila de entrada termina, o lote inteiro já foi distribuído
+            distributed = dispatcher.submit(source_id, None, flush_pending_albums, source_id)
+            await _wait_checkpoint(previous)
+            previous = (distributed, batch_last, count, processed)
+
+        async def _wait_checkpoint(pending):
+            nonlocal copied_now, copied_total, last_msg
+            if pending is None:
+                return
+            distributed, batch_last, count, processed = pending
+            await distributed
+            await dispatcher.barrier(source_id, [dest_id])
+            if batch_last is None:
+                return
+            copied_now += count
+            # Mensagens copiadas numa execução interrompida também entram no total
+            copied_total += processed
+            last_msg = batch_last
+            await db.save_clone_job(source_id, dest_id, last_msg, copied_total, 'running')
+
+        async for message in rate_limiter.iter_history(client, source_id, min_id=last_msg):
+            # Mensagens de serviço (entrada de membros, fixação, etc.) não são copiadas
+            if getattr(message, 'action', None):
+                continue
+            # O lote só é fechado fora de um álbum, para que o álbum seja enviado inteiro
+            same_album = message.grouped_id and batch and message.grouped_id == batch[-1].grouped_id
+            if len(batch) >= CLONE_BATCH_SIZE and not same_album:
+                await submit_batch(batch)
+                batch = []
+
+                if is_limit_reached():
+                    logger.error("[CLONE] Limite de ações atingido. Clonagem interrompida.")
+                    break
+
+                now = time.monotonic()
+                if progress_callback and now - last_report >= CLONE_PROGRESS_INTERVAL:
+                    last_report = now
+                    await progress_callback(_format_progress(copied_now, copied_total, last_msg, now - started))
+            batch.append(message)
+        else:
+            if batch:
+                await submit_batch(batch)
+
+        await _wait_checkpoint(previous)
+        elapsed = time.monotonic() - started
+        status = 'running' if is_limit_reached() else 'done'
+        await db.save_clone_job(source_id, dest_id, last_msg, copied_total, status)
+
+        summary = _format_progress(copied_now, copied_total, last_msg, elapsed, finished=status == 'done')
+        logger.info(f"[CLONE] {source_id} -> {dest_id}: {summary}")
+        if progress_callback:
+            await progress_callback(summary)
+        return copied_now
+
+    except Exception as e:
+        logger.error(f"[CLONE] Erro na clonagem {source_chat} -> {dest_chat}: {e}", exc_info=True)
+        if progress_callback:
+            await progress_callback(f"❌ Clonagem interrompida: {e}\nExecute o comando novamente para continuar de onde parou.")
+        return copied_now
+    finally:
+        _active_clones.discard(key)
+
+def _format_progress(copied_now, copied_total, last_msg, elapsed, finished=False):
+    rate = copied_now / elapsed if elapsed > 0 else 0.0
+    title = "✅ Clonagem concluída" if finished else "⏳ Clonagem em andamento"
+    return (
+        f"{title}\n"
+        f"• Mensagens copiadas nesta execução: {copied_now}\n"
+        f"• Total copiado: {copied_total}\n"
+        f"• Última mensagem: {last_msg}\n"
+        f"• Velocidade: {rate:.1f} msg/s"
+    )
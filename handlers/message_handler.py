@@ -1,16 +1,47 @@
 from telethon import events, errors
 from telethon.tl.functions.channels import JoinChannelRequest
-from database.db_manager import DatabaseManager
+from telethon.tl.functions.messages import ForwardMessagesRequest
+from telethon.tl.types import UpdateMessageID, UpdateNewMessage, UpdateNewChannelMessage
+from telethon.helpers import generate_random_long
+from database.db_manager import get_db
 from utils.scheduler import is_active
-from filters.content_filter import filter_content, safe_text
-from utils.bypass_tools import bypass_restriction
-from filters.media_replacer import replace_media
-from utils.logger import logger
-from utils.resource_handler import is_limit_reached, increment_action_count
-import json
+from filters.content_filter import filter_content, SafeText
+from utils.bypass_tools import bypass_restriction, relay_restricted_media
+from filters.media_replacer import replace_media, media_index
+from utils.logger import get_logger, mark_received, is_event_log_enabled, log_replication_event
+from utils.dispatcher import dispatcher
+from utils.album_buffer import AlbumBuffer
+from utils.rate_limiter import rate_limiter
+from utils.upload_cache import upload_cache
+from utils.resource_handler import is_limit_reached, increment_action_count, get_config
+import asyncio
+import itertools
+import logging
 import os
 
-db = DatabaseManager()
+logger = get_logger('message_handler')
+
+# Limite padrão de envios simultâneos para os chats de destino
+DEFAULT_MAX_CONCURRENT_SENDS = 10
+_send_semaphore = None
+_send_semaphore_limit = None
+
+# Janela padrão (ms) para aguardar os demais itens de um álbum
+DEFAULT_ALBUM_WINDOW_MS = 800
+_album_buffer = AlbumBuffer()
+
+# Máximo de mensagens por chamada de encaminhamento (limite do Telegram)
+FORWARD_BATCH_LIMIT = 100
+# Lotes de encaminhamento ainda na fila: (source_chat, dest) -> (mensagens do lote, Future do envio)
+_forward_batches = {}
+class _SendFallback(Exception):
+    """
+    Sinaliza que o envio agrupado (álbum ou encaminhamento) foi recusado e as mensagens
+    devem ser reenviadas uma a uma. É tratado fora do limitador, para que os envios
+    individuais tenham seus próprios limites e não ocupem o slot do envio agrupado.
+    """
+# Chats de origem com encaminhamento bloqueado (conteúdo protegido)
+_forward_restricted_chats = set()
 
 async def handle_new_message(event):
     # Verifica se o limite de ações foi atingido
@@ -32,212 +63,585 @@ async def handle_new_message(event):
             # Lista de comandos administrativos que sempre funcionam
             admin_commands = ['/help', '/status', '/config', '/block', '/unblock', '/blocklist', 
                              '/replace', '/unreplace', '/replacelist', '/schedule', '/settime', 
-                             '/showschedule', '/deletestatus', '/clearmappings', '/textoonly']
+                             '/showschedule', '/deletestatus', '/clearmappings', '/textoonly',
+                             '/clonehistory']
             command = event.raw_text.split()[0].lower()
             is_admin_command = command in admin_commands
         
         # Verifica se o bot está ativo pelo agendador (exceto para comandos administrativos)
         if not is_active and not is_admin_command:
             # Log mais detalhado para debug
-            logger.info(f"Bot inativo pelo agendador. Ignorando mensagem: '{event.raw_text if event.raw_text else '[Media]'}'")
+            logger.info("Bot inativo pelo agendador. Ignorando mensagem: '%s'", event.raw_text or '[Media]')
             return
             
-        # Identifica o tipo de mensagem para log mais informativo
-        if event.raw_text:
-            # Mensagem com texto
-            logger.info(f"Nova mensagem recebida: {safe_text(event.raw_text)}")
-        elif event.sticker:
-            # É um sticker
-            sticker_id = str(event.document.id)
-            sticker_set = getattr(event.document, 'sticker_set', None)
-            emoji = None
-            for attr in getattr(event.document, 'attributes', []):
-                if hasattr(attr, 'alt'):
-                    emoji = attr.alt
-                    break
-            
-            logger.info(f"Sticker recebido [ID: {sticker_id}]{f', Emoji: {emoji}' if emoji else ''}")
-        elif event.photo:
-            # É uma foto
-            photo_id = str(event.photo.id)
-            caption = event.raw_text or "[Sem legenda]"
-            logger.info(f"Foto recebida [ID: {photo_id}], Legenda: {caption}")
-        elif event.document:
-            # É um documento/arquivo
-            doc_id = str(event.document.id)
-            mime_type = getattr(event.document, 'mime_type', 'desconhecido')
-            filename = "desconhecido"
-            for attr in getattr(event.document, 'attributes', []):
-                if hasattr(attr, 'file_name'):
-                    filename = attr.file_name
-                    break
-                    
-            logger.info(f"Documento recebido [ID: {doc_id}], Tipo: {mime_type}, Nome: {filename}")
-        elif event.video:
-            # É um vídeo
-            video_id = str(event.video.id)
-            duration = "desconhecida"
-            for attr in getattr(event.video, 'attributes', []):
-                if hasattr(attr, 'duration'):
-                    duration = f"{attr.duration} segundos"
-                    break
-                    
-            logger.info(f"Vídeo recebido [ID: {video_id}], Duração: {duration}")
-        else:
-            # Outro tipo de mídia
-            logger.info("Mídia recebida [Tipo desconhecido]")
+        # Identifica o tipo de mensagem para log mais informativo (só se o nível INFO estiver ativo)
+        if logger.isEnabledFor(logging.INFO):
+            _log_received_message(event)
             
         # Se é um comando administrativo, deixa passar para outros handlers
         if is_admin_command:
-            logger.debug(f"Comando administrativo detectado: {event.raw_text}")
+            logger.debug("Comando administrativo detectado: %s", event.raw_text)
             return
         
-        # Carrega configurações
-        with open('config.json', 'r') as f:
-            config = json.load(f)
-
-        # Aplica filtros de conteúdo apenas para mensagens de texto
-        if not event.media:
-            filtered_message = await filter_content(event, config)
-            if not filtered_message:
-                logger.warning(f"Mensagem bloqueada: {safe_text(event.text)}")
-                return
-        else:
-            filtered_message = event.raw_text or ""
-            
-        # Garante que filtered_message é uma string Unicode válida
-        if filtered_message and isinstance(filtered_message, bytes):
-            try:
-                filtered_message = filtered_message.decode('utf-8')
-            except UnicodeDecodeError:
-                filtered_message = filtered_message.decode('utf-8', errors='replace')
+        # Replica a mensagem para os destinos configurados
+        config = get_config()
+        # Desfaz as filas de destinos que saíram da configuração
+        dispatcher.set_destinations(config['destination_chats'])
+        await replicate_message(event.message, config['destination_chats'], config)
 
-        # Processa mídias restritas (prepara para substituição)
-        media_data = await bypass_restriction(event)
+    except Exception as e:
+        logger.error("Erro ao processar mensagem: %s", e, exc_info=True)
 
-        # Verifica se há uma substituição configurada
-        replacement_path = await replace_media(event, config)
+def _log_received_message(event):
+    """Registra o tipo e os dados principais da mensagem recebida."""
+    if event.raw_text:
+        # Mensagem com texto
+        logger.info("Nova mensagem recebida: %s", SafeText(event.raw_text))
+    elif event.sticker:
+        # É um sticker
+        sticker_id = str(event.document.id)
+        sticker_set = getattr(event.document, 'sticker_set', None)
+        emoji = None
+        for attr in getattr(event.document, 'attributes', []):
+            if hasattr(attr, 'alt'):
+                emoji = attr.alt
+                break
         
-        # Realiza a substituição se necessário
-        if replacement_path:
-            # Simplificando o log para não mostrar o caminho completo
-            logger.info(f"Mídia será substituída: {os.path.basename(replacement_path)}")
-            
-            # Verifica se é um sticker (baseado na extensão do arquivo)
-            if replacement_path.endswith('.webp') or replacement_path.endswith('.webm') or replacement_path.endswith('.tgs'):
-                # Para stickers, precisamos enviar com os atributos corretos
-                media_data = {
-                    "file": replacement_path, 
-                    "attributes": None,
-                    "is_sticker": True  # Marcamos como sticker para tratamento especial
-                }
-            else:
-                # Para outros tipos de mídia
-                media_data = {"file": replacement_path, "attributes": None}
+        logger.info("Sticker recebido [ID: %s]%s", sticker_id, f", Emoji: {emoji}" if emoji else "")
+    elif event.photo:
+        # É uma foto
+        photo_id = str(event.photo.id)
+        caption = event.raw_text or "[Sem legenda]"
+        logger.info("Foto recebida [ID: %s], Legenda: %s", photo_id, caption)
+    elif event.document:
+        # É um documento/arquivo
+        doc_id = str(event.document.id)
+        mime_type = getattr(event.document, 'mime_type', 'desconhecido')
+        filename = "desconhecido"
+        for attr in getattr(event.document, 'attributes', []):
+            if hasattr(attr, 'file_name'):
+                filename = attr.file_name
+                break
+                
+        logger.info("Documento recebido [ID: %s], Tipo: %s, Nome: %s", doc_id, mime_type, filename)
+    elif event.video:
+        # É um vídeo
+        video_id = str(event.video.id)
+        duration = "desconhecida"
+        for attr in getattr(event.video, 'attributes', []):
+            if hasattr(attr, 'duration'):
+                duration = f"{attr.duration} segundos"
+                break
+                
+        logger.info("Vídeo recebido [ID: %s], Duração: %s", video_id, duration)
+    else:
+        # Outro tipo de mídia
+        logger.info("Mídia recebida [Tipo desconhecido]")
+
+async def replicate_message(message, dest_chats, config=None):
+    """
+    Pipeline de replicação de uma mensagem de origem: filtros de conteúdo, substituição
+    de mídia, agrupamento de álbuns e distribuição para as filas de dest_chats.
+    Usado pelos eventos de nova mensagem e pela retomada do outbox.
+    """
+    # Obtém o snapshot atual das configurações (recarregado só quando o arquivo muda)
+    config = config or get_config()
+    # Mensagens do outbox, backfill e clonagem medem a latência a partir daqui
+    mark_received(message)
 
-        # Verifica se deve replicar apenas texto
-        if config.get("replicar_apenas_texto", False) and event.media:
-            logger.info("Mensagem ignorada por ser mídia e 'replicar_apenas_texto' está ativado.")
+    # Aplica filtros de conteúdo apenas para mensagens de texto
+    if not message.media:
+        filtered_message = await filter_content(message, config)
+        if not filtered_message:
+            logger.warning("Mensagem bloqueada: %s", SafeText(message.text))
+            await get_db().note_source_message(message.chat_id, message.id)
             return
+    else:
+        filtered_message = message.raw_text or ""
+        
+    # Garante que filtered_message é uma string Unicode válida
+    if filtered_message and isinstance(filtered_message, bytes):
+        try:
+            filtered_message = filtered_message.decode('utf-8')
+        except UnicodeDecodeError:
+            filtered_message = filtered_message.decode('utf-8', errors='replace')
+
+    # Verifica se deve replicar apenas texto
+    if config.get("replicar_apenas_texto", False) and message.media:
+        logger.info("Mensagem ignorada por ser mídia e 'replicar_apenas_texto' está ativado.")
+        await get_db().note_source_message(message.chat_id, message.id)
+        return
+
+    # Processa mídias restritas (prepara para substituição)
+    media_data = await bypass_restriction(message)
+
+    # Verifica se há uma substituição configurada
+    replacement_path = await replace_media(message, config)
+    
+    # Realiza a substituição se necessário
+    if replacement_path:
+        # Simplificando o log para não mostrar o caminho completo
+        logger.info("Mídia será substituída: %s", os.path.basename(replacement_path))
+        
+        # Verifica se é um sticker (baseado na extensão do arquivo)
+        if replacement_path.endswith('.webp') or replacement_path.endswith('.webm') or replacement_path.endswith('.tgs'):
+            # Para stickers, precisamos enviar com os atributos corretos
+            media_data = {
+                "file": replacement_path, 
+                "attributes": None,
+                "is_sticker": True  # Marcamos como sticker para tratamento especial
+            }
+        else:
+            # Para outros tipos de mídia
+            media_data = {"file": replacement_path, "attributes": None}
+
+    # Registra os envios no outbox antes de enviar, para retomá-los após uma queda,
+    # e marca a mensagem como processada para o backfill
+    await get_db().add_outbox_jobs(message.chat_id, message.id, dest_chats)
+    await get_db().note_source_message(message.chat_id, message.id)
+
+    # Álbuns pendentes deste chat são enviados antes, para manter a ordem das mensagens
+    grouped_id = message.grouped_id if media_data else None
+    await flush_pending_albums(message.chat_id, exclude=(message.chat_id, grouped_id))
+
+    # Itens de álbum aguardam os demais para serem enviados juntos
+    if grouped_id:
+        window = int(config.get('album_window_ms', DEFAULT_ALBUM_WINDOW_MS)) / 1000
+        _album_buffer.add(
+            (message.chat_id, grouped_id),
+            (message, media_data, filtered_message, replacement_path, dest_chats),
+            window, _schedule_album_flush
+        )
+        return
+
+    _fan_out(message, dest_chats, config, media_data, filtered_message, replacement_path)
+
+def _fan_out(event, dest_chats, config, media_data, filtered_message, replacement_path):
+    """
+    Distribui o envio para a fila de cada destino: a ordem é mantida dentro de cada
+    par (origem, destino) e os destinos são atendidos em paralelo, respeitando o
+    limite de envios simultâneos.
+    """
+    semaphore = _get_send_semaphore(config)
+    forward = _can_forward(event, filtered_message, replacement_path, config)
+    for dest in dest_chats:
+        if forward:
+            _queue_forward([event], dest, semaphore)
+            continue
+        _forward_batches.pop((event.chat_id, dest), None)
+        dispatcher.submit(
+            event.chat_id, dest,
+            _send_with_limit, semaphore, event, dest, media_data, filtered_message, replacement_path
+        )
+
+def _schedule_album_flush(key):
+    """Fim da janela de espera: envia o álbum pela fila de entrada do chat de origem."""
+    dispatcher.submit(key[0], None, _flush_album, key)
+
+async def flush_pending_albums(chat_id=None, exclude=None):
+    """
+    Envia imediatamente os álbuns pendentes do chat (ou de todos os chats). Deve ser
+    chamado antes de processar outro evento do mesmo chat, para preservar a ordem.
+    """
+    for key in _album_buffer.pending_keys(chat_id, exclude):
+        await _flush_album(key)
+
+async def _flush_album(key):
+    """Distribui um álbum completo para as filas de destino."""
+    items = _album_buffer.pop(key)
+    if not items:
+        return
+
+    items.sort(key=lambda item: item[0].id)
+    if len(items) > 1:
+        logger.info("Álbum %s com %s itens pronto para envio", key[1], len(items))
+    config = get_config()
+    semaphore = _get_send_semaphore(config)
+
+    # Cada item traz seus próprios destinos (na retomada do outbox podem faltar só alguns),
+    # então o álbum de cada destino contém apenas os itens que devem ir para ele
+    dests = list(dict.fromkeys(dest for item in items for dest in item[4]))
+    for dest in dests:
+        dest_items = [item[:4] for item in items if dest in item[4]]
+        if all(_can_forward(event, filtered_message, replacement_path, config)
+               for event, _, filtered_message, replacement_path in dest_items):
+            # Álbum sem alterações: encaminhado inteiro em uma única chamada
+            _queue_forward([item[0] for item in dest_items], dest, semaphore)
+            continue
+        _forward_batches.pop((key[0], dest), None)
+        if len(dest_items) == 1:
+            dispatcher.submit(key[0], dest, _send_with_limit, semaphore, dest_items[0][0], dest, *dest_items[0][1:])
+        else:
+            dispatcher.submit(key[0], dest, _send_album_with_limit, semaphore, dest_items, dest)
+
+async def _send_album_with_limit(semaphore, items, dest):
+    """Envia um álbum para um destino respeitando o limite de envios simultâneos."""
+    messages = [item[0] for item in items]
+    try:
+        sent_msgs = await _send_album_limited(items, dest, semaphore)
+    except Exception as e:
+        _log_send_events(messages, dest, None, 'album', e)
+        raise
+    _log_send_events(messages, dest, sent_msgs, 'album')
+    return sent_msgs
+
+async def _send_album_limited(items, dest, semaphore):
+    """Envia o álbum pelo limitador e, se ele for recusado, os itens um a um."""
+    try:
+        return await rate_limiter.run(dest, _send_album_to_destination, items, dest, slot=semaphore)
+    except _SendFallback:
+        return await _send_items_separately(items, dest, semaphore)
+
+async def _send_album_to_destination(items, dest):
+    """Envia o álbum com uma única chamada e salva o mapeamento de cada item."""
+    if not is_active:
+        logger.info("Bot desativado durante o processamento. Interrompendo envio.")
+        return None
+
+    client = items[0][0].client
+    try:
+        # Arquivos de substituição locais reaproveitam o upload em cache, como nos envios avulsos
+        local_paths = [replacement_path if replacement_path and media_data['file'] == replacement_path else None
+                       for _, media_data, _, replacement_path in items]
+        sent_msgs = await upload_cache.send_album(
+            client, dest,
+            [media_data['file'] for _, media_data, _, _ in items],
+            local_paths,
+            file_stats=[media_index.get_stat(path) if path else None for path in local_paths],
+            restat=media_index.refresh_stat,
+            caption=[filtered_message for _, _, filtered_message, _ in items]
+        )
+    except errors.FloodWaitError:
+        # Tratado pelo limitador, que adia e repete o envio
+        raise
+    except Exception as e:
+        # Se o álbum for recusado, os itens são enviados um a um (fora do limitador deste envio)
+        logger.error("Erro ao enviar álbum para %s: %s. Enviando itens separadamente.", dest, e)
+        raise _SendFallback() from e
+
+    # A resposta vem na mesma ordem dos arquivos enviados
+    for (event, _, _, _), sent_msg in zip(items, sent_msgs):
+        try:
+            await get_db().insert_message(event.chat_id, event.id, dest, sent_msg.id)
+        except Exception as e:
+            logger.error("Erro ao salvar mapeamento: %s", e)
+    logger.info("Álbum com %s itens enviado para %s", len(sent_msgs), dest)
+    return sent_msgs
 
-        # Envia para todos os destinos configurados
-        for dest in config['destination_chats']:
-            # Verifica novamente se o bot ainda está ativo 
-            # (em caso de ter sido desativado durante o processamento)
-            if not is_active:
-                logger.info("Bot desativado durante o processamento. Interrompendo envio.")
-                return
+async def _send_items_separately(items, dest, semaphore):
+    """
+    Envia os itens um a um. Cada item passa pelo limitador por conta própria: um
+    FloodWait adia e repete só o item atual, sem reenviar os que já foram enviados.
+    """
+    sent_msgs = []
+    for event, media_data, filtered_message, replacement_path in items:
+        try:
+            sent_msgs.append(await rate_limiter.run(
+                dest, _send_to_destination, event, dest, media_data, filtered_message, replacement_path,
+                slot=semaphore
+            ))
+        except errors.FloodWaitError:
+            # O limitador desistiu do item: o job continua no outbox para a próxima retomada
+            sent_msgs.append(None)
+    return sent_msgs
 
+def _can_forward(message, filtered_message, replacement_path, config):
+    """
+    Indica se a mensagem pode ser encaminhada em vez de reconstruída: nenhum
+    filtro ou substituição a alterou e o chat de origem permite encaminhamento.
+    """
+    return (
+        config.get('forward_unchanged', True)
+        and not replacement_path
+        and filtered_message == (message.raw_text or "")
+        and not getattr(message, 'noforwards', False)
+        and message.chat_id not in _forward_restricted_chats
+    )
+
+def _queue_forward(messages, dest, semaphore):
+    """
+    Enfileira o encaminhamento das mensagens para o destino. Enquanto o lote
+    anterior do mesmo par ainda não começou a ser enviado, as mensagens são
+    acrescentadas a ele e seguem na mesma chamada. Retorna o Future do lote.
+    """
+    key = (messages[0].chat_id, dest)
+    entry = _forward_batches.get(key)
+    if entry is not None and len(entry[0]) + len(messages) <= FORWARD_BATCH_LIMIT:
+        entry[0].extend(messages)
+        return entry[1]
+    batch = list(messages)
+    future = dispatcher.submit(key[0], dest, _forward_with_limit, semaphore, key, batch)
+    _forward_batches[key] = (batch, future)
+    return future
+
+async def _forward_with_limit(semaphore, key, batch):
+    """Encaminha um lote respeitando o limite de envios simultâneos."""
+    # O lote é fechado ao começar: novas mensagens iniciam outro lote
+    entry = _forward_batches.get(key)
+    if entry is not None and entry[0] is batch:
+        del _forward_batches[key]
+    try:
+        try:
+            sent_msgs = await rate_limiter.run(key[1], _forward_to_destination, batch, key[1], slot=semaphore)
+        except _SendFallback:
+            sent_msgs = await _resend_messages(batch, key[1], semaphore)
+    except Exception as e:
+        _log_send_events(batch, key[1], None, 'forward', e)
+        raise
+    _log_send_events(batch, key[1], sent_msgs, 'forward')
+    return sent_msgs
+
+async def _forward_to_destination(messages, dest):
+    """
+    Encaminha as mensagens como cópia (sem o cabeçalho "Encaminhada de") com uma
+    única chamada, sem baixar nem reenviar mídia, e salva os mapeamentos. Se o
+    chat de origem não permitir encaminhamento, levanta _SendFallback para que as
+    mensagens sejam reenviadas.
+    """
+    if not is_active:
+        logger.info("Bot desativado durante o processamento. Interrompendo envio.")
+        return None
+
+    source_chat = messages[0].chat_id
+    if source_chat in _forward_restricted_chats:
+        raise _SendFallback()
+
+    client = messages[0].client
+    try:
+        # client.forward_messages() desta versão do Telethon não aceita drop_author
+        random_ids = [generate_random_long() for _ in messages]
+        result = await client(ForwardMessagesRequest(
+            from_peer=await messages[0].get_input_chat(),
+            id=[message.id for message in messages],
+            to_peer=await client.get_input_entity(dest),
+            drop_author=True,
+            random_id=random_ids
+        ))
+        sent_msgs = _forwarded_messages(result, random_ids)
+    except errors.FloodWaitError:
+        # Tratado pelo limitador, que adia e repete o envio
+        raise
+    except errors.ChatForwardsRestrictedError:
+        logger.info("Chat %s não permite encaminhamento. Mensagens serão reenviadas.", source_chat)
+        _forward_restricted_chats.add(source_chat)
+        raise _SendFallback()
+    except Exception as e:
+        logger.error("Erro ao encaminhar mensagens para %s: %s. Reenviando as mensagens.", dest, e)
+        raise _SendFallback() from e
+
+    # A resposta vem na mesma ordem dos IDs encaminhados
+    for message, sent_msg in zip(messages, sent_msgs):
+        if sent_msg is None:
+            continue
+        try:
+            await get_db().insert_message(source_chat, message.id, dest, sent_msg.id)
+        except Exception as e:
+            logger.error("Erro ao salvar mapeamento: %s", e)
+    logger.info("%s mensagens encaminhadas para %s", len(messages), dest)
+    return sent_msgs
+
+def _forwarded_messages(result, random_ids):
+    """
+    Extrai da resposta do encaminhamento as mensagens criadas, na ordem dos random_ids
+    do pedido (None para as que não vieram). Cada UpdateMessageID liga um random_id ao
+    novo ID; sem eles, vale a ordem dos UpdateNewMessage/UpdateNewChannelMessage.
+    """
+    id_by_random = {}
+    new_messages = []
+    for update in getattr(result, 'updates', ()):
+        if isinstance(update, UpdateMessageID):
+            id_by_random[update.random_id] = update.id
+        elif isinstance(update, (UpdateNewMessage, UpdateNewChannelMessage)):
+            new_messages.append(update.message)
+
+    if not id_by_random:
+        return new_messages[:len(random_ids)]
+    by_id = {message.id: message for message in new_messages}
+    return [by_id.get(id_by_random.get(random_id)) for random_id in random_ids]
+
+async def _resend_messages(messages, dest, semaphore):
+    """
+    Reenvia pelo caminho normal mensagens que não puderam ser encaminhadas. Cada grupo
+    passa pelo limitador separadamente, para que um FloodWait não repita o lote inteiro.
+    """
+    sent_msgs = []
+    # Itens de um mesmo álbum continuam agrupados no reenvio
+    for _, group in itertools.groupby(messages, key=lambda message: message.grouped_id or -message.id):
+        items = [(message, await bypass_restriction(message), message.raw_text or "", None) for message in group]
+        if len(items) > 1:
             try:
-                if media_data:
-                    # Envia a mídia substituída ou original
-                    if media_data.get("is_sticker", False) or (event.sticker and not replacement_path):
-                        # Envia como sticker
-                        try:
-                            sent_msg = await event.client.send_file(
-                                entity=dest,
-                                file=media_data['file'],
-                                force_document=False,     # Não enviar como documento
-                                allow_cache=False,       # Não usar cache
-                                supports_streaming=False, # Não é streaming
-                                silent=False,             # Notificar o chat
-                                attributes=media_data.get('attributes'),
-                                mime_type="image/webp"    # Força o MIME type para stickers
-                            )
-                            # Log simplificado
-                            logger.info(f"Sticker enviado para {dest}")
-                        except Exception as sticker_error:
-                            logger.error(f"Erro ao enviar sticker: {sticker_error}")
-                            # Tenta enviar como documento em caso de falha
-                            sent_msg = await event.client.send_file(
-                                entity=dest,
-                                file=media_data['file']
-                            )
-                    else:
-                        # Envia mídia normal
-                        sent_msg = await event.client.send_file(
-                            entity=dest,
-                            file=media_data['file'],
-                            caption=filtered_message,
-                            attributes=media_data.get('attributes', None)
-                        )
-                    
-                    # Salva mapeamento no banco para TODAS as mensagens (incluindo mídia)
-                    # para garantir que a deleção funcione corretamente
-                    try:
-                        db.insert_message(event.chat_id, event.id, sent_msg.id)
-                        logger.debug(f"Mapeamento salvo: {event.id} -> {sent_msg.id}")
-                    except Exception as e:
-                        logger.error(f"Erro ao salvar mapeamento: {e}")
-                else:
-                    # Envia mensagem de texto - garante que está em formato Unicode
+                sent_msgs.extend(await _send_album_limited(items, dest, semaphore) or [])
+            except errors.FloodWaitError:
+                sent_msgs.extend([None] * len(items))
+        else:
+            sent_msgs.extend(await _send_items_separately(items, dest, semaphore))
+    return sent_msgs
+
+def _get_send_semaphore(config):
+    """Retorna o semáforo que limita os envios simultâneos, recriando-o se o limite mudar."""
+    global _send_semaphore, _send_semaphore_limit
+    limit = max(1, int(config.get('max_concurrent_sends', DEFAULT_MAX_CONCURRENT_SENDS)))
+    if _send_semaphore is None or _send_semaphore_limit != limit:
+        _send_semaphore = asyncio.Semaphore(limit)
+        _send_semaphore_limit = limit
+    return _send_semaphore
+
+async def _send_with_limit(semaphore, event, dest, media_data, filtered_message, replacement_path):
+    """
+    Envia para um destino respeitando o limite de envios simultâneos. O semáforo é
+    ocupado só durante a chamada à API, não na espera do limitador ou de um FloodWait.
+    """
+    try:
+        sent_msg = await rate_limiter.run(
+            dest, _send_to_destination, event, dest, media_data, filtered_message, replacement_path,
+            slot=semaphore
+        )
+    except Exception as e:
+        _log_send_events([event], dest, None, 'send', e)
+        raise
+    _log_send_events([event], dest, [sent_msg], 'send')
+    return sent_msg
+
+def _log_send_events(messages, dest, sent_msgs, mode, error=None):
+    """Registra no log de eventos o resultado do envio de cada mensagem para o destino."""
+    if not is_event_log_enabled():
+        return
+    sent_msgs = list(sent_msgs or [])
+    for index, message in enumerate(messages):
+        sent_msg = sent_msgs[index] if index < len(sent_msgs) else None
+        extra = {"error": str(error)} if error else {}
+        log_replication_event(
+            'send', message.chat_id, message.id, dest, 'ok' if sent_msg else 'failed',
+            dest_msg=getattr(sent_msg, 'id', None), size=_payload_size(message),
+            received_at=getattr(message, 'received_at', None), mode=mode, **extra
+        )
+
+def _payload_size(message):
+    """Tamanho (bytes) da mídia da mensagem, ou do texto se não houver mídia."""
+    if message.file:
+        return message.file.size
+    return len((message.raw_text or "").encode('utf-8'))
+
+async def _send_media_file(event, dest, media_data, replacement_path, **kwargs):
+    """
+    Envia a mídia, reaproveitando o upload em cache quando for um arquivo de substituição local.
+    Se o envio por referência for recusado por conteúdo protegido, a mídia é baixada e enviada
+    uma única vez; os demais destinos da mensagem passam a usar o mesmo InputFile.
+    """
+    if replacement_path and media_data['file'] == replacement_path:
+        return await upload_cache.send_file(
+            event.client, dest, replacement_path,
+            file_stat=media_index.get_stat(replacement_path),
+            restat=media_index.refresh_stat, **kwargs
+        )
+    try:
+        return await event.client.send_file(entity=dest, file=media_data['file'], **kwargs)
+    except errors.ChatForwardsRestrictedError:
+        logger.info("Mídia da mensagem %s é protegida. Baixando e reenviando.", event.id)
+        relayed = await relay_restricted_media(event)
+        if relayed is None:
+            raise
+        # media_data é compartilhado pelos destinos da mensagem
+        media_data.update(relayed)
+        return await event.client.send_file(entity=dest, file=relayed['file'], **kwargs)
+
+async def _send_to_destination(event, dest, media_data, filtered_message, replacement_path):
+    """Envia a mensagem para um único destino e salva o mapeamento. Retorna a mensagem enviada ou None."""
+    # Verifica novamente se o bot ainda está ativo 
+    # (em caso de ter sido desativado durante o processamento)
+    if not is_active:
+        logger.info("Bot desativado durante o processamento. Interrompendo envio.")
+        return None
+
+    try:
+        if media_data:
+            # Envia a mídia substituída ou original
+            if media_data.get("is_sticker", False) or (event.sticker and not replacement_path):
+                # Envia como sticker
+                try:
+                    sent_msg = await _send_media_file(
+                        event, dest, media_data, replacement_path,
+                        force_document=False,     # Não enviar como documento
+                        allow_cache=False,       # Não usar cache
+                        supports_streaming=False, # Não é streaming
+                        silent=False,             # Notificar o chat
+                        attributes=media_data.get('attributes'),
+                        mime_type="image/webp"    # Força o MIME type para stickers
+                    )
+                    # Log simplificado
+                    logger.info("Sticker enviado para %s", dest)
+                except errors.FloodWaitError:
+                    raise
+                except Exception as sticker_error:
+                    logger.error("Erro ao enviar sticker: %s", sticker_error)
+                    # Tenta enviar como documento em caso de falha
+                    sent_msg = await _send_media_file(event, dest, media_data, replacement_path)
+            else:
+                # Envia mídia normal
+                sent_msg = await _send_media_file(
+                    event, dest, media_data, replacement_path,
+                    caption=filtered_message,
+                    attributes=media_data.get('attributes', None)
+                )
+            
+            # Salva mapeamento no banco para TODAS as mensagens (incluindo mídia)
+            # para garantir que a deleção funcione corretamente
+            try:
+                await get_db().insert_message(event.chat_id, event.id, dest, sent_msg.id)
+                logger.debug("Mapeamento salvo: %s -> %s (%s)", event.id, sent_msg.id, dest)
+            except Exception as e:
+                logger.error("Erro ao salvar mapeamento: %s", e)
+        else:
+            # Envia mensagem de texto - garante que está em formato Unicode
+            try:
+                sent_msg = await event.client.send_message(
+                    entity=dest,
+                    message=filtered_message,
+                    parse_mode='md'  # Usa markdown para melhor suporte a caracteres especiais
+                )
+            except errors.ChatAdminRequiredError:
+                logger.warning("Permissão de admin necessária para enviar no chat %s. Tentando método alternativo...", dest)
+                try:
+                    # Tenta entrar no canal/grupo se possível
                     try:
-                        sent_msg = await event.client.send_message(
-                            entity=dest,
-                            message=filtered_message,
-                            parse_mode='md'  # Usa markdown para melhor suporte a caracteres especiais
-                        )
-                    except errors.ChatAdminRequiredError:
-                        logger.warning(f"Permissão de admin necessária para enviar no chat {dest}. Tentando método alternativo...")
-                        try:
-                            # Tenta entrar no canal/grupo se possível
-                            try:
-                                await event.client(JoinChannelRequest(dest))
-                                logger.info(f"Entrou automaticamente no chat {dest}")
-                            except:
-                                logger.warning(f"Não foi possível entrar no chat {dest}")
-                            
-                            # Tenta enviar como mensagem simples sem formatação
-                            sent_msg = await event.client.send_message(
-                                entity=dest,
-                                message=filtered_message,
-                                parse_mode=None,  # Desativa formatação para evitar problemas
-                                link_preview=False  # Desativa preview para evitar problemas
-                            )
-                            logger.info(f"Mensagem enviada com bypass para {dest}")
-                        except Exception as bypass_error:
-                            logger.error(f"Falha no bypass para {dest}: {bypass_error}")
-                            continue
+                        await event.client(JoinChannelRequest(dest))
+                        logger.info("Entrou automaticamente no chat %s", dest)
+                    except:
+                        logger.warning("Não foi possível entrar no chat %s", dest)
                     
-                    # Salva mapeamento no banco
-                    try:
-                        db.insert_message(event.chat_id, event.id, sent_msg.id)
-                        logger.debug(f"Mapeamento salvo: {event.id} -> {sent_msg.id}")
-                    except Exception as e:
-                        logger.error(f"Erro ao salvar mapeamento: {e}")
-
-            except errors.ChatWriteForbiddenError:
-                logger.error(f"Sem permissão para escrever no chat {dest}. Verifique se o bot foi adicionado como membro.")
-                continue
-            except errors.UserBannedInChannelError:
-                logger.error(f"Bot banido no chat {dest}. Não é possível enviar mensagens.")
-                continue
-            except errors.ChannelPrivateError:
-                logger.error(f"O chat {dest} é privado e o bot não tem acesso. Adicione o bot no grupo/canal.")
-                continue
+                    # Tenta enviar como mensagem simples sem formatação
+                    sent_msg = await event.client.send_message(
+                        entity=dest,
+                        message=filtered_message,
+                        parse_mode=None,  # Desativa formatação para evitar problemas
+                        link_preview=False  # Desativa preview para evitar problemas
+                    )
+                    logger.info("Mensagem enviada com bypass para %s", dest)
+                except Exception as bypass_error:
+                    logger.error("Falha no bypass para %s: %s", dest, bypass_error)
+                    return None
+            
+            # Salva mapeamento no banco
+            try:
+                await get_db().insert_message(event.chat_id, event.id, dest, sent_msg.id)
+                logger.debug("Mapeamento salvo: %s -> %s (%s)", event.id, sent_msg.id, dest)
             except Exception as e:
-                logger.error(f"Erro ao enviar mensagem para {dest}: {e}")
-                continue
+                logger.error("Erro ao salvar mapeamento: %s", e)
+
+        return sent_msg
 
+    except errors.FloodWaitError:
+        # Tratado pelo limitador, que adia e repete o envio
+        raise
+    except errors.ChatWriteForbiddenError:
+        logger.error("Sem permissão para escrever no chat %s. Verifique se o bot foi adicionado como membro.", dest)
+        return None
+    except errors.UserBannedInChannelError:
+        logger.error("Bot banido no chat %s. Não é possível enviar mensagens.", dest)
+        return None
+    except errors.ChannelPrivateError:
+        logger.error("O chat %s é privado e o bot não tem acesso. Adicione o bot no grupo/canal.", dest)
+        return None
     except Exception as e:
-        logger.error(f"Erro ao processar mensagem: {e}", exc_info=True)
+        logger.error("Erro ao enviar mensagem para %s: %s", dest, e)
+        return None
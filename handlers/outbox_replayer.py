@@ -0,0 +1,74 @@
+from database.db_manager import get_db
+from handlers.message_handler import replicate_message
+from utils.dispatcher import dispatcher
+from utils.logger import logger
+from utils.rate_limiter import rate_limiter
+
+# Tentativas de retomada antes de um job ser descartado do outbox
+OUTBOX_MAX_ATTEMPTS = 5
+# Quantidade de mensagens buscadas por chamada de get_messages
+OUTBOX_FETCH_BATCH = 100
+
+async def replay_outbox(client):
+    """
+    Retoma os envios que ficaram pendentes no outbox (processo encerrado ou
+    desconectado no meio do envio). A entrega é "pelo menos uma vez": destinos
+    que já têm mapeamento gravado são considerados concluídos e não reenviados.
+    Retorna a quantidade de mensagens reenfileiradas.
+    """
+    try:
+        db = get_db()
+
+        discarded = await db.purge_outbox(OUTBOX_MAX_ATTEMPTS)
+        if discarded:
+            logger.warning(f"[OUTBOX] {discarded} envios descartados após {OUTBOX_MAX_ATTEMPTS} tentativas")
+
+        jobs = await db.get_outbox_jobs()
+        if not jobs:
+            return 0
+
+        logger.info(f"[OUTBOX] Retomando {len(jobs)} envios pendentes")
+        await db.mark_outbox_attempt(jobs)
+
+        # Agrupa os jobs por chat de origem e mensagem
+        pending = {}
+        for source_chat, source_msg, dest_chat in jobs:
+            pending.setdefault(source_chat, {}).setdefault(source_msg, []).append(dest_chat)
+
+        replayed = 0
+        for source_chat, by_msg in pending.items():
+            source_msgs = sorted(by_msg)
+
+            # Destinos que já receberam a mensagem (mapeamento gravado) não são reenviados
+            mapped = await db.get_mapped_messages_bulk(source_chat, source_msgs)
+            done = [
+                (source_chat, source_msg, dest_chat)
+                for source_msg in source_msgs for dest_chat in by_msg[source_msg]
+                if dest_chat in mapped.get(source_msg, {})
+            ]
+
+            for i in range(0, len(source_msgs), OUTBOX_FETCH_BATCH):
+                chunk = source_msgs[i:i + OUTBOX_FETCH_BATCH]
+                messages = await rate_limiter.run(source_chat, client.get_messages, source_chat, ids=chunk)
+
+                for source_msg, message in zip(chunk, messages):
+                    dest_chats = [dest for dest in by_msg[source_msg] if dest not in mapped.get(source_msg, {})]
+                    if not dest_chats:
+                        continue
+                    if message is None:
+                        # Mensagem apagada na origem: não há mais o que enviar
+                        done.extend((source_chat, source_msg, dest) for dest in dest_chats)
+                        continue
+
+                    # Passa pela fila de entrada do chat, como uma mensagem nova
+                    dispatcher.submit(source_chat, None, replicate_message, message, dest_chats)
+                    replayed += 1
+
+            await db.complete_outbox_jobs(done)
+
+        logger.info(f"[OUTBOX] {replayed} mensagens reenfileiradas para envio")
+        return replayed
+
+    except Exception as e:
+        logger.error(f"[OUTBOX] Erro ao retomar envios pendentes: {e}", exc_info=True)
+        return 0
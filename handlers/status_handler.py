@@ -1,19 +1,19 @@
 from telethon import events
 from utils.logger import logger
 from utils.scheduler import is_active
-import json
+from utils.dispatcher import dispatcher
+from database.db_manager import get_db
+from utils.rate_limiter import rate_limiter
+from utils.resource_handler import get_config
 import os
 import datetime
 
-CONFIG_PATH = 'config.json'
-
 async def handle_status_command(event):
     """Envia mensagem com o status atual do bot."""
     try:
         if event.raw_text.strip() == "/status":
-            # Carrega configurações
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            # Obtém o snapshot das configurações
+            config = get_config()
             
             # Verifica o tamanho do diretório de mídia
             media_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "media")
@@ -26,6 +26,27 @@ async def handle_status_command(event):
             # Verifica o status do agendador
             scheduler_enabled = config.get('schedule', {}).get('enable', False)
             
+            # Estado das filas de replicação (origem, destino)
+            lane_stats = dispatcher.get_stats()
+            busiest_lanes = sorted(lane_stats, key=lambda lane: lane['lag'], reverse=True)[:3]
+            lanes_text = "".join(
+                f"\n• {lane['source_chat']} → {lane['dest_chat'] if lane['dest_chat'] is not None else 'entrada'}: "
+                f"{lane['depth']} pendentes, atraso {lane['lag']:.1f}s"
+                for lane in busiest_lanes if lane['depth']
+            )
+            
+            # Envios registrados no outbox e ainda não concluídos
+            outbox_pending = await get_db().count_outbox_jobs()
+            
+            # Estado do limitador de envios (pausas por FloodWait)
+            throttle = rate_limiter.get_stats()
+            throttle_text = "".join(
+                f"\n• Chat {chat} pausado: {remaining:.0f}s restantes"
+                for chat, remaining in sorted(throttle['blocked_chats'].items(), key=lambda item: -item[1])[:3]
+            )
+            if throttle['global_blocked'] > 0:
+                throttle_text = f"\n• Pausa global: {throttle['global_blocked']:.0f}s restantes" + throttle_text
+            
             # Formata a mensagem de status
             status_message = f"""
 📊 **TClone Bot - Status Atual** 📊
@@ -49,6 +70,16 @@ async def handle_status_command(event):
 • Substituições de texto: {len(config.get('replacements', {}))}
 • Apenas texto: {'✅' if config.get('replicar_apenas_texto', False) else '❌'}
 
+📬 **Filas de Replicação:**
+• Filas ativas: {len(lane_stats)}
+• Tarefas pendentes: {dispatcher.total_depth()}
+• Envios pendentes no outbox: {outbox_pending}
+• Maior atraso: {dispatcher.max_lag():.1f}s{lanes_text}
+
+🚦 **Limite de Envios:**
+• Global: {throttle['global_rate']:g}/s • Por chat: {throttle['chat_rate']:g}/s
+• FloodWaits recebidos: {throttle['flood_waits']}{throttle_text}
+
 🕒 **Agendamento:**
 • Horário de início: {config.get('schedule', {}).get('start_time', 'N/A')}
 • Horário de término: {config.get('schedule', {}).get('end_time', 'N/A')}
@@ -1,13 +1,11 @@
 from telethon import events
 from utils.logger import logger
-import json
+from utils.resource_handler import get_media_dir, get_config, load_config, save_config
+from filters.media_replacer import invalidate_media_index
 import os
 
 # Diretório para armazenar as mídias de substituição
-MEDIA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "media")
-os.makedirs(MEDIA_DIR, exist_ok=True)
-
-CONFIG_PATH = 'config.json'
+MEDIA_DIR = get_media_dir()
 
 async def handle_sticker_commands(event):
     """
@@ -61,18 +59,17 @@ async def handle_sticker_commands(event):
                     file_path = await ev.download_media(
                         file=os.path.join(MEDIA_DIR, f"{custom_id}.tgs")
                     )
+                    invalidate_media_index()
                     
                     # Atualiza o config.json
-                    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
+                    config = load_config()
                         
                     if 'sticker_replacements' not in config:
                         config['sticker_replacements'] = {}
                         
                     config['sticker_replacements'][original_id] = custom_id.replace("sticker_", "")
                     
-                    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-                        json.dump(config, f, indent=4, ensure_ascii=False)
+                    save_config(config)
                         
                     # Confirma para o usuário
                     await event.client.send_message(
@@ -133,18 +130,17 @@ async def handle_sticker_commands(event):
                     file_path = await ev.download_media(
                         file=os.path.join(MEDIA_DIR, f"{custom_id}.jpg")
                     )
+                    invalidate_media_index()
                     
                     # Atualiza o config.json
-                    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                        config = json.load(f)
+                    config = load_config()
                         
                     if 'image_replacements' not in config:
                         config['image_replacements'] = {}
                         
                     config['image_replacements'][original_id] = custom_id.replace("image_", "")
                     
-                    with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-                        json.dump(config, f, indent=4, ensure_ascii=False)
+                    save_config(config)
                         
                     # Confirma para o usuário
                     await event.client.send_message(
@@ -173,8 +169,7 @@ async def handle_sticker_commands(event):
             
         # Comando para listar substituições
         elif command_name == "/list":
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = get_config()
                 
             sticker_replacements = config.get('sticker_replacements', {})
             image_replacements = config.get('image_replacements', {})
@@ -203,8 +198,7 @@ async def handle_sticker_commands(event):
         elif command_name == "/remove" and len(command) > 1:
             original_id = command[1]
             
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = load_config()
                 
             sticker_replacements = config.get('sticker_replacements', {})
             
@@ -218,8 +212,7 @@ async def handle_sticker_commands(event):
             
             # Salva as alterações
             config['sticker_replacements'] = sticker_replacements
-            with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            save_config(config)
                 
             await event.respond(f"✅ Substituição de sticker removida com sucesso!\n\nOriginal: `{original_id}`\nSubstituto: `{replacement_id}`")
             return
@@ -228,8 +221,7 @@ async def handle_sticker_commands(event):
         elif command_name == "/removeimg" and len(command) > 1:
             original_id = command[1]
             
-            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            config = load_config()
                 
             image_replacements = config.get('image_replacements', {})
             
@@ -243,8 +235,7 @@ async def handle_sticker_commands(event):
             
             # Salva as alterações
             config['image_replacements'] = image_replacements
-            with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            save_config(config)
                 
             await event.respond(f"✅ Substituição de imagem removida com sucesso!\n\nOriginal: `{original_id}`\nSubstituto: `{replacement_id}`")
             return
@@ -1,6 +1,7 @@
 from telethon import events
 from utils.logger import logger
 from utils.resource_handler import get_media_dir
+from filters.media_replacer import invalidate_media_index
 import os
 import asyncio
 from telethon.tl.types import DocumentAttributeFilename, InputStickerSetID
@@ -53,6 +54,7 @@ async def download_media(event):
             file_path = await replied_msg.download_media(
                 file=os.path.join(MEDIA_DIR, f"sticker_{custom_id}{extension}")
             )
+            invalidate_media_index()
             
             media_type = "Sticker"
             
@@ -66,6 +68,7 @@ async def download_media(event):
         elif replied_msg.photo:
             # É uma imagem
             file_path = await replied_msg.download_media(os.path.join(MEDIA_DIR, f"image_{custom_id}.jpg"))
+            invalidate_media_index()
             media_type = "Imagem"
             original_id = replied_msg.photo.id
             
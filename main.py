@@ -7,12 +7,15 @@ import asyncio
 import signal
 import os
 from telethon import TelegramClient, events
-from database.db_manager import DatabaseManager
-from handlers.message_handler import handle_new_message
+from database.db_manager import get_db, flush_db, close_db
+from handlers.message_handler import handle_new_message, flush_pending_albums
+from handlers.outbox_replayer import replay_outbox
+from handlers.backfill import run_backfill
+from handlers.history_cloner import clone_history, parse_chat_ref
 from handlers.edit_handler import handle_edit
 from handlers.delete_handler import handle_delete
-from utils.scheduler import setup_scheduler
-from utils.logger import setup_logger
+from utils.scheduler import setup_scheduler, register_activation_callback
+from utils.logger import setup_logger, shutdown_logging, apply_log_levels, mark_received
 from handlers.id_extractor import extract_ids
 from handlers.sticker_downloader import download_media
 from handlers.sticker_commander import handle_sticker_commands
@@ -26,17 +29,13 @@ from utils.permissions_checker import verify_permissions
 import time
 from utils.resource_handler import get_config_path, get_app_root, load_config, is_bundled
 from utils.scheduler import is_active as scheduler_is_active
-from utils.resource_handler import increment_action_count, is_limit_reached
+from utils.resource_handler import increment_action_count, is_limit_reached, flush_usage_data
+from utils.dispatcher import dispatcher
+from utils.rate_limiter import CLIENT_FLOOD_SLEEP_THRESHOLD
 
 # Configuração inicial
 logger = setup_logger()  # Inicializa logs com nível padrão
 
-# Semáforo global para controlar operações
-GLOBAL_OP_LOCK = asyncio.Lock()
-
-# Flag para indicar quando uma exclusão está em andamento
-delete_in_progress = False
-
 # Flag para controlar o encerramento do programa
 shutdown_event = asyncio.Event()
 
@@ -53,8 +52,11 @@ except ImportError:
     HAS_WIN32API = False
 
 # Define as funções wrapper ANTES de usá-las no main()
-async def handle_delete_with_lock(event):
-    """Função wrapper para handle_delete que usa o lock global"""
+# Cada evento é enfileirado na pista de entrada do seu chat de origem: a ordem do
+# Telegram é mantida por chat, e chats independentes são replicados em paralelo
+async def handle_delete_dispatch(event):
+    """Função wrapper que enfileira handle_delete na pista do chat de origem"""
+    mark_received(event)
     # Verifica se o limite de ações foi atingido
     if is_limit_reached():
         logger.error("Limite de ações atingido. Acesse https://global.tribopay.com.br/qpqbz5koox ou entre em contato pelo perfil t.me/roge_rdv para adquirir a versão completa.")
@@ -65,21 +67,17 @@ async def handle_delete_with_lock(event):
         logger.error("Erro ao incrementar contador de ações. Acesso bloqueado.")
         return
 
-    global delete_in_progress
-    delete_in_progress = True
-    
-    try:
-        # As deleções devem ocorrer mesmo quando o bot está inativo
-        # Adquire o lock com prioridade máxima
-        async with GLOBAL_OP_LOCK:
-            # Processa a exclusão com prioridade
-            await handle_delete(event)
-    finally:
-        # Sempre define como False, mesmo se houver erro
-        delete_in_progress = False
+    # As deleções devem ocorrer mesmo quando o bot está inativo
+    dispatcher.submit(event.chat_id, None, handle_delete, event)
+
+async def handle_edit_dispatch(event):
+    """Função wrapper que enfileira handle_edit na pista do chat de origem"""
+    mark_received(event)
+    dispatcher.submit(event.chat_id, None, handle_edit, event)
 
-async def handle_message_with_lock(event):
-    """Função wrapper para handle_new_message que espera exclusões terminarem"""
+async def handle_message_dispatch(event):
+    """Função wrapper que enfileira handle_new_message na pista do chat de origem"""
+    mark_received(event.message)
     # Verifica se o limite de ações foi atingido
     if is_limit_reached():
         logger.error("Limite de ações atingido. Acesse https://global.tribopay.com.br/qpqbz5koox ou entre em contato pelo perfil t.me/roge_rdv para adquirir a versão completa.")
@@ -110,13 +108,7 @@ async def handle_message_with_lock(event):
         logger.info(f"Bot inativo: mensagem ignorada no wrapper (tipo: {'texto' if event.raw_text else 'mídia'}")
         return
     
-    # Se uma exclusão estiver em andamento, aguarda um pouco
-    if delete_in_progress:
-        await asyncio.sleep(0.5)  # Espera 500ms para permitir que a exclusão termine
-    
-    # Adquire o lock apenas quando não houver exclusões em andamento
-    async with GLOBAL_OP_LOCK:
-        await handle_new_message(event)
+    dispatcher.submit(event.chat_id, None, handle_new_message, event)
 
 # Handler para sinais (CTRL+C)
 def signal_handler():
@@ -137,6 +129,13 @@ async def shutdown(client):
     try:
         logger.info("Iniciando encerramento limpo...")
         
+        # Envia os álbuns ainda na janela de espera e aguarda as filas de replicação
+        # esvaziarem antes de desconectar
+        await flush_pending_albums()
+        logger.info(f"Aguardando filas de replicação ({dispatcher.total_depth()} tarefas pendentes)...")
+        await dispatcher.drain(timeout=30)
+        await dispatcher.stop()
+        
         # Desconecta o cliente Telegram
         if client and client.is_connected():
             logger.info("Desconectando cliente Telegram...")
@@ -145,22 +144,85 @@ async def shutdown(client):
         # Fecha quaisquer recursos abertos
         logger.info("Fechando recursos...")
         
-        # Exemplo: Fechar conexão com o banco de dados
-        from database.db_manager import DatabaseManager
-        db = DatabaseManager()
-        if hasattr(db, 'conn') and db.conn:
-            db.close()
-            logger.info("Conexão com o banco de dados fechada.")
+        # Grava os mapeamentos pendentes e fecha a conexão compartilhada com o banco de dados
+        await flush_db()
+        close_db()
+        logger.info("Conexão com o banco de dados fechada.")
+        
+        # Grava o contador de ações mantido em memória
+        flush_usage_data()
             
         logger.info("Encerramento concluído. Saindo...")
         
     except Exception as e:
         logger.error(f"Erro durante o encerramento: {e}", exc_info=True)
     finally:
+        # Grava os logs ainda na fila antes de sair
+        shutdown_logging()
         # Garante que o programa será finalizado
         sys.exit(0)
 
-async def main():
+async def register_handlers(client, config):
+    """Registra os handlers de comandos e de replicação dos chats de origem."""
+    # Registra os handlers administrativos primeiro (que funcionam mesmo quando inativo)
+    client.add_event_handler(
+        handle_help_command, 
+        events.NewMessage()
+    )
+    client.add_event_handler(
+        handle_status_command, 
+        events.NewMessage()
+    )
+    # Registra o handler para comandos de configuração
+    client.add_event_handler(
+        handle_config_commands, 
+        events.NewMessage()
+    )
+    
+    # Registra o handler para comandos de stickers (que também podem ser administrativos)
+    client.add_event_handler(
+        handle_sticker_commands, 
+        events.NewMessage()
+    )
+    
+    # Para garantir que o processamento de exclusão seja realmente instantâneo,
+    # registra o handler de exclusão PRIMEIRO para garantir processamento prioritário
+    client.add_event_handler(
+        handle_delete_dispatch,  # Modificado para não precisar de client como parâmetro
+        events.MessageDeleted(chats=config['source_chats'])
+    )
+    
+    # Pequeno delay para garantir prioridade de exclusão
+    await asyncio.sleep(0.1)
+    
+    # Outros handlers com prioridade normal - registra depois para menor prioridade
+    client.add_event_handler(
+        handle_message_dispatch,  # Modificado para não precisar de client como parâmetro
+        events.NewMessage(chats=config['source_chats'])
+    )
+    
+    client.add_event_handler(
+        handle_edit_dispatch, 
+        events.MessageEdited(chats=config['source_chats'])
+    )
+    
+    # Registra handlers auxiliares
+    client.add_event_handler(
+        extract_ids, 
+        events.NewMessage(chats=config['source_chats'])
+    )
+    client.add_event_handler(
+        download_media, 
+        events.NewMessage(chats=config['source_chats'])
+    )
+    
+    logger.info("Handlers registrados com sucesso.")
+
+async def main(clone_args=None):
+    """
+    Inicia o bot. Com clone_args=(origem, destino), apenas copia o histórico
+    da origem para o destino e encerra (modo --clone-history).
+    """
     client = None  # Define fora do try para estar disponível no finally
     
     try:
@@ -193,6 +255,9 @@ async def main():
         logger.setLevel(numeric_level)
         logger.info(f"Nível de log configurado para: {log_level}")
         
+        # Níveis específicos por subsistema (ex: {"message_handler": "WARNING"})
+        apply_log_levels(config)
+        
         # Verifica API ID, que é sempre necessário
         api_id = config.get('api_id')
         if not api_id:
@@ -230,7 +295,8 @@ async def main():
             client = TelegramClient(
                 session=session_name,
                 api_id=api_id,
-                api_hash=api_hash
+                api_hash=api_hash,
+                flood_sleep_threshold=CLIENT_FLOOD_SLEEP_THRESHOLD
             )
             
             logger.info("Iniciando com token de bot...")
@@ -246,74 +312,28 @@ async def main():
             client = TelegramClient(
                 session='bot_session',
                 api_id=api_id,
-                api_hash=api_hash
+                api_hash=api_hash,
+                flood_sleep_threshold=CLIENT_FLOOD_SLEEP_THRESHOLD
             )
             logger.info("Iniciando com credenciais de usuário...")
             
             # Define o modo de autenticação
             auth_mode = "user"
         
-        # Inicializa o banco de dados
-        db = DatabaseManager()
+        # Inicializa o banco de dados compartilhado (a manutenção roda depois, pelo agendador)
+        get_db()
         logger.info("Banco de dados inicializado")
         
-        # Registra os handlers administrativos primeiro (que funcionam mesmo quando inativo)
-        client.add_event_handler(
-            handle_help_command, 
-            events.NewMessage()
-        )
-        client.add_event_handler(
-            handle_status_command, 
-            events.NewMessage()
-        )
-        # Registra o handler para comandos de configuração
-        client.add_event_handler(
-            handle_config_commands, 
-            events.NewMessage()
-        )
-        
-        # Registra o handler para comandos de stickers (que também podem ser administrativos)
-        client.add_event_handler(
-            handle_sticker_commands, 
-            events.NewMessage()
-        )
-        
-        # Para garantir que o processamento de exclusão seja realmente instantâneo,
-        # registra o handler de exclusão PRIMEIRO para garantir processamento prioritário
-        client.add_event_handler(
-            handle_delete_with_lock,  # Modificado para não precisar de client como parâmetro
-            events.MessageDeleted(chats=config['source_chats'])
-        )
-        
-        # Pequeno delay para garantir prioridade de exclusão
-        await asyncio.sleep(0.1)
-        
-        # Outros handlers com prioridade normal - registra depois para menor prioridade
-        client.add_event_handler(
-            handle_message_with_lock,  # Modificado para não precisar de client como parâmetro
-            events.NewMessage(chats=config['source_chats'])
-        )
-        
-        client.add_event_handler(
-            handle_edit, 
-            events.MessageEdited(chats=config['source_chats'])
-        )
-        
-        # Registra handlers auxiliares
-        client.add_event_handler(
-            extract_ids, 
-            events.NewMessage(chats=config['source_chats'])
-        )
-        client.add_event_handler(
-            download_media, 
-            events.NewMessage(chats=config['source_chats'])
-        )
+        # Estado dos chats de origem antes de qualquer mensagem ao vivo: ponto de partida do backfill
+        backfill_watermarks = get_db().get_source_watermarks()
         
-        logger.info("Handlers registrados com sucesso.")
-        
-        # Configura o agendador
-        setup_scheduler(client)
-        logger.info("Agendador ativado")
+        # No modo --clone-history o processo só clona e encerra: sem handlers nem agendador
+        if not clone_args:
+            await register_handlers(client, config)
+            
+            # Configura o agendador
+            setup_scheduler(client)
+            logger.info("Agendador ativado")
         
         if is_limit_reached():
             logger.error("Limite de ações atingido. Acesse https://global.tribopay.com.br/qpqbz5koox ou entre em contato pelo perfil t.me/roge_rdv para adquirir a versão completa.")
@@ -386,9 +406,26 @@ async def main():
                 logger.error("Falha na autenticação de usuário.")
             return
         
+        # Modo --clone-history: copia o histórico e encerra sem iniciar o bot
+        if clone_args:
+            async def log_progress(text):
+                logger.info(f"[CLONE] {text}")
+            
+            await clone_history(client, *clone_args, progress_callback=log_progress)
+            return
+        
         # Envia mensagem de boas-vindas após a conexão
         await send_welcome_message(client)
         
+        # Retoma os envios que ficaram pendentes na última execução
+        await replay_outbox(client)
+        
+        # Recupera em segundo plano as mensagens publicadas enquanto o bot estava parado,
+        # e de novo sempre que o agendador reativar o bot (o estado é copiado no momento
+        # da ativação, antes de as mensagens ao vivo serem processadas)
+        register_activation_callback(lambda: run_backfill(client, get_db().get_source_watermarks()))
+        asyncio.create_task(run_backfill(client, backfill_watermarks))
+        
         # Substitui a linha original client.run_until_disconnected() 
         # por uma implementação mais robusta que responde ao CTRL+C
         try:
@@ -432,8 +469,17 @@ if __name__ == "__main__":
             except Exception as e:
                 print(f"Erro ao configurar handler de CTRL+C via win32api: {e}")
         
+        # Modo de linha de comando: python main.py --clone-history ORIGEM DESTINO
+        clone_args = None
+        if "--clone-history" in sys.argv:
+            index = sys.argv.index("--clone-history")
+            if len(sys.argv) < index + 3:
+                print("Uso: python main.py --clone-history ORIGEM DESTINO")
+                sys.exit(1)
+            clone_args = (parse_chat_ref(sys.argv[index + 1]), parse_chat_ref(sys.argv[index + 2]))
+        
         # Executa o programa principal com tratamento de KeyboardInterrupt
-        asyncio.run(main())
+        asyncio.run(main(clone_args))
     except KeyboardInterrupt:
         print("\nPrograma terminado por KeyboardInterrupt (CTRL+C)")
     except Exception as e:
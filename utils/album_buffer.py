@@ -0,0 +1,39 @@
+import asyncio
+
+class AlbumBuffer:
+    """
+    Agrupa as mensagens de um álbum (mesmo grouped_id), que o Telegram entrega
+    em eventos NewMessage separados.
+
+    Cada novo item reinicia a janela de espera do álbum; quando a janela
+    expira sem novos itens, on_timeout(key) é chamado para enviar o álbum.
+    """
+
+    def __init__(self):
+        self._albums = {}  # (chat_id, grouped_id) -> lista de itens na ordem de chegada
+        self._timers = {}  # (chat_id, grouped_id) -> TimerHandle da janela de espera
+
+    def add(self, key, item, window, on_timeout):
+        """Adiciona um item ao álbum e (re)inicia a janela de espera de window segundos."""
+        self._albums.setdefault(key, []).append(item)
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        self._timers[key] = asyncio.get_running_loop().call_later(window, on_timeout, key)
+
+    def pop(self, key):
+        """Remove e retorna os itens do álbum (ou None se já foi enviado)."""
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        return self._albums.pop(key, None)
+
+    def pending_keys(self, chat_id=None, exclude=None):
+        """Chaves dos álbuns pendentes (de um chat, se informado), exceto exclude."""
+        return [
+            key for key in self._albums
+            if (chat_id is None or key[0] == chat_id) and key != exclude
+        ]
+
+    def __len__(self):
+        return len(self._albums)
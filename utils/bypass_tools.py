@@ -2,8 +2,16 @@ from telethon import errors
 from telethon.tl.types import DocumentAttributeFilename, MessageMediaDocument, MessageMediaPhoto
 from telethon.tl.functions.channels import JoinChannelRequest
 from utils.logger import logger
-import io
+from utils.media_relay import relay_media
+from utils.resource_handler import get_config
+from collections import OrderedDict
 import asyncio
+import mimetypes
+
+# Mídias de conteúdo protegido já reenviadas: (chat_id, msg_id) -> Task com os dados da mídia.
+# Todos os destinos (e os reenvios) da mesma mensagem reaproveitam o mesmo InputFile
+RELAY_CACHE_SIZE = 32
+_relays = OrderedDict()
 
 async def bypass_restriction(event):
     try:
@@ -11,67 +19,92 @@ async def bypass_restriction(event):
         if not event.media:
             return None
 
-        # Estratégia 1: Usa a mídia original diretamente
-        try:
-            if event.sticker:
-                # Se for um sticker, marca explicitamente
-                return {
-                    "file": event.document,
-                    "attributes": getattr(event.document, "attributes", None),
-                    "is_sticker": True,
-                    "mime_type": getattr(event.document, "mime_type", "image/webp")
-                }
-            return {
-                "file": event.document or event.photo,
-                "attributes": getattr(event.document, "attributes", None) if event.document else None
-            }
-        except:
-            # Se falhar, tenta métodos alternativos
-            pass
-            
-        # Estratégia 2: Baixa e re-envia a mídia
-        try:
-            # Baixa o arquivo para a memória
-            media_bytes = io.BytesIO()
-            await event.download_media(file=media_bytes)
-            media_bytes.seek(0)  # Retorna ao início do arquivo
-            
-            # Obtém o tipo correto de mídia
-            mime_type = None
-            filename = None
-            
-            if event.document:
-                for attr in event.document.attributes:
-                    if isinstance(attr, DocumentAttributeFilename):
-                        filename = attr.file_name
-                        break
-                mime_type = getattr(event.document, 'mime_type', None)
-            
+        # Conteúdo protegido: a mídia não pode ser enviada por referência
+        if getattr(event, 'noforwards', False):
+            return await relay_restricted_media(event)
+
+        # Usa a mídia original diretamente (por referência, sem baixar)
+        if event.sticker:
+            # Se for um sticker, marca explicitamente
             return {
-                "file": media_bytes, 
-                "attributes": getattr(event.document, "attributes", None) if event.document else None,
-                "mime_type": mime_type,
-                "filename": filename,
-                "is_sticker": event.sticker,
-                "is_photo": event.photo is not None,
-                "is_video": event.video is not None,
-                "is_voice": event.voice is not None,
-                "is_audio": event.audio is not None,
-                "is_gif": event.gif is not None
+                "file": event.document,
+                "attributes": getattr(event.document, "attributes", None),
+                "is_sticker": True,
+                "mime_type": getattr(event.document, "mime_type", "image/webp")
             }
-            
-        except Exception as e:
-            logger.error(f"Erro no bypass de mídia (método 2): {e}")
-            pass
-            
-        # Se todas as estratégias falharem, retorna None
-        logger.warning("Todas as estratégias de bypass de mídia falharam")
-        return None
+        return {
+            "file": event.document or event.photo,
+            "attributes": getattr(event.document, "attributes", None) if event.document else None
+        }
 
     except Exception as e:
         logger.error(f"Erro ao processar mídia para compartilhamento: {e}", exc_info=True)
         return None
 
+async def relay_restricted_media(event):
+    """
+    Baixa a mídia da mensagem e a envia ao Telegram uma única vez, retornando os
+    dados da mídia com o InputFile resultante (ou None se falhar). Chamadas para a
+    mesma mensagem aguardam e reaproveitam o mesmo upload.
+    """
+    key = (event.chat_id, event.id)
+    task = _relays.get(key)
+    if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+        task = asyncio.ensure_future(_relay(event))
+        _relays[key] = task
+    _relays.move_to_end(key)
+    while len(_relays) > RELAY_CACHE_SIZE:
+        _relays.popitem(last=False)
+
+    try:
+        # shield: se um destino for cancelado, o upload continua para os demais
+        return await asyncio.shield(task)
+    except Exception as e:
+        logger.error(f"Erro no bypass de mídia (download e reenvio): {e}")
+        return None
+
+async def _relay(event):
+    # Obtém o tipo correto de mídia
+    mime_type = None
+    filename = None
+    
+    if event.document:
+        for attr in event.document.attributes:
+            if isinstance(attr, DocumentAttributeFilename):
+                filename = attr.file_name
+                break
+        mime_type = getattr(event.document, 'mime_type', None)
+    
+    # Baixa o arquivo (em memória ou em disco, conforme o tamanho) e o envia
+    # uma única vez; o InputFile resultante é reaproveitado por todos os destinos
+    file_name = _guess_file_name({"filename": filename, "mime_type": mime_type, "is_photo": event.photo is not None})
+    input_file = await relay_media(event.client, event, file_name, get_config())
+    logger.info(f"Mídia protegida da mensagem {event.id} reenviada como {file_name}")
+    
+    return {
+        "file": input_file, 
+        "attributes": getattr(event.document, "attributes", None) if event.document else None,
+        "mime_type": mime_type,
+        "filename": filename,
+        "is_sticker": event.sticker,
+        "is_photo": event.photo is not None,
+        "is_video": event.video is not None,
+        "is_voice": event.voice is not None,
+        "is_audio": event.audio is not None,
+        "is_gif": event.gif is not None
+    }
+
+def _guess_file_name(media_data):
+    """Nome de arquivo para o upload, usando o nome original ou a extensão do tipo MIME."""
+    if media_data.get("filename"):
+        return media_data["filename"]
+    if media_data.get("is_photo"):
+        return "photo.jpg"
+    extension = mimetypes.guess_extension(media_data.get("mime_type") or "") or ""
+    if media_data.get("mime_type") == "application/x-tgsticker":
+        extension = ".tgs"
+    return f"media{extension}"
+
 async def attempt_group_join(client, chat_id):
     """Tenta entrar em um grupo/canal para obter acesso."""
     try:
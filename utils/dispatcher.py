@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import deque
+from utils.logger import logger
+
+# Tempo (s) sem tarefas após o qual a pista é desfeita e seu worker encerrado
+LANE_IDLE_TIMEOUT = 300
+
+class _Lane:
+    """Fila ordenada de tarefas de um par (chat de origem, chat de destino)."""
+
+    def __init__(self, key):
+        self.key = key
+        self.queue = asyncio.Queue()
+        self.pending = deque()  # Momentos de enfileiramento das tarefas ainda não concluídas
+        self.worker = None
+        self.processed = 0
+        self.failed = 0
+        self.retiring = False  # Destino removido da configuração: encerra ao esvaziar
+
+    def lag(self, now=None):
+        """Tempo (s) desde o enfileiramento da tarefa mais antiga ainda não concluída."""
+        if not self.pending:
+            return 0.0
+        return (now or time.monotonic()) - self.pending[0]
+
+class OrderedDispatcher:
+    """
+    Despacha tarefas em pistas independentes, uma fila e um worker por par
+    (chat de origem, chat de destino).
+
+    Dentro de uma pista as tarefas são executadas estritamente na ordem de
+    chegada; pistas diferentes rodam em paralelo. A pista (origem, None) é a
+    pista de entrada do chat de origem, onde os eventos são preparados antes
+    de serem distribuídos para as pistas de cada destino.
+
+    Pistas sem tarefas por LANE_IDLE_TIMEOUT segundos são desfeitas (e recriadas
+    no próximo submit), assim como as pistas de destinos removidos da configuração.
+    """
+
+    def __init__(self):
+        self._lanes = {}
+        self._dest_chats = None  # Destinos configurados na última chamada de set_destinations
+
+    def submit(self, source_chat, dest_chat, job, *args):
+        """Enfileira job(*args) na pista (source_chat, dest_chat) e retorna um Future com o resultado."""
+        lane = self._get_lane((source_chat, dest_chat))
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        lane.pending.append(enqueued_at)
+        lane.queue.put_nowait((job, args, future))
+        return future
+
+    async def barrier(self, source_chat, dest_chats):
+        """Aguarda até que as tarefas já enfileiradas nas pistas de destino do chat de origem terminem."""
+        await asyncio.gather(*(self.submit(source_chat, dest, _noop) for dest in dest_chats))
+
+    def _get_lane(self, key):
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = _Lane(key)
+            self._lanes[key] = lane
+        lane.retiring = False
+        if lane.worker is None or lane.worker.done():
+            lane.worker = asyncio.create_task(self._run_lane(lane))
+        return lane
+
+    def set_destinations(self, dest_chats):
+        """
+        Informa os destinos configurados. As pistas de destinos que saíram da
+        configuração são desfeitas: na hora, se estiverem vazias, ou assim que
+        terminarem as tarefas já enfileiradas.
+        """
+        if dest_chats == self._dest_chats:
+            return
+        self._dest_chats = dest_chats
+        active = set(dest_chats)
+        for lane in list(self._lanes.values()):
+            if lane.key[1] is None or lane.key[1] in active:
+                continue
+            if lane.pending:
+                lane.retiring = True
+            else:
+                self._retire(lane)
+                if lane.worker and not lane.worker.done():
+                    lane.worker.cancel()
+
+    def _retire(self, lane):
+        """Remove a pista do despachante (se ainda for a pista registrada para a chave)."""
+        if self._lanes.get(lane.key) is lane:
+            del self._lanes[lane.key]
+            logger.debug(f"Fila {lane.key} encerrada")
+
+    async def _run_lane(self, lane):
+        """Worker da pista: executa as tarefas uma a uma, na ordem em que chegaram."""
+        while True:
+            if lane.retiring and lane.queue.empty():
+                self._retire(lane)
+                return
+            try:
+                job, args, future = await asyncio.wait_for(lane.queue.get(), LANE_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if lane.queue.empty():
+                    self._retire(lane)
+                    return
+                continue
+            try:
+                result = await job(*args)
+                lane.processed += 1
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                # Uma falha não pode travar a pista: registra e segue para a próxima tarefa
+                lane.failed += 1
+                logger.error(f"Erro em tarefa da fila {lane.key}: {e}", exc_info=True)
+                if not future.done():
+                    future.set_result(None)
+            finally:
+                lane.pending.popleft()
+                lane.queue.task_done()
+
+    def get_stats(self):
+        """Retorna profundidade, atraso e contadores de cada pista."""
+        now = time.monotonic()
+        return [
+            {
+                "source_chat": lane.key[0],
+                "dest_chat": lane.key[1],
+                "depth": len(lane.pending),
+                "lag": lane.lag(now),
+                "processed": lane.processed,
+                "failed": lane.failed,
+            }
+            for lane in self._lanes.values()
+        ]
+
+    def total_depth(self):
+        """Total de tarefas pendentes em todas as pistas."""
+        return sum(len(lane.pending) for lane in self._lanes.values())
+
+    def max_lag(self):
+        """Maior atraso (s) entre todas as pistas."""
+        now = time.monotonic()
+        return max((lane.lag(now) for lane in self._lanes.values()), default=0.0)
+
+    async def drain(self, timeout=None):
+        """Aguarda o esvaziamento de todas as pistas (usado no encerramento)."""
+        joins = [lane.queue.join() for lane in self._lanes.values()]
+        if not joins:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*joins), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Tempo esgotado aguardando filas de replicação ({self.total_depth()} tarefas pendentes)")
+
+    async def stop(self):
+        """Cancela os workers de todas as pistas."""
+        workers = [lane.worker for lane in self._lanes.values() if lane.worker and not lane.worker.done()]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+async def _noop():
+    return None
+
+# Instância global do despachante
+dispatcher = OrderedDispatcher()
@@ -1,9 +1,239 @@
 import logging
+import logging.handlers
 import os
 import sys
-from datetime import datetime
-import codecs
-from utils.resource_handler import get_logs_dir
+import queue
+import atexit
+import gzip
+import json
+import re
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.resource_handler import get_logs_dir, get_config_path, get_config
+
+# Máximo de registros aguardando gravação; acima disso novos registros são descartados
+LOG_QUEUE_SIZE = 10000
+
+# Tamanho máximo (MB) de um arquivo de log antes de ser rotacionado
+DEFAULT_LOG_MAX_MB = 50
+# Dias que os logs antigos (compactados) são mantidos
+DEFAULT_LOG_RETENTION_DAYS = 14
+
+# Logger do registro de eventos de replicação (JSON lines), separado dos logs de texto
+EVENT_LOGGER_NAME = 'TelegramForwarderBotEvents'
+_event_log_enabled = False
+
+# Filas de log ativas: nome do logger -> (listener, handler da fila, handlers de saída)
+_pipelines = {}
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enfileira os registros sem bloquear quem chama o log. A formatação e a
+    escrita (console e arquivo) acontecem na thread do QueueListener; se a fila
+    estiver cheia, o registro é descartado e contado em vez de travar o bot.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # A formatação fica para a thread do listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Grava em logs/bot_AAAAMMDD.log e troca de arquivo na virada do dia ou quando
+    o arquivo passa de max_bytes. Cada arquivo fechado vira um segmento
+    bot_AAAAMMDD_N.log, compactado para .log.gz em uma thread separada; os
+    segmentos mais antigos que retention_days são apagados.
+    """
+
+    def __init__(self, log_dir, prefix='bot', max_bytes=0, retention_days=0, encoding='utf-8-sig', extension='.log'):
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self._segment_pattern = re.compile(
+            rf'^{re.escape(prefix)}_(\d{{8}})(?:_(\d+))?{re.escape(extension)}(\.gz)?$'
+        )
+        self._workers = []
+        self._set_day(time.time())
+        super().__init__(self._day_file(self._day), 'a', encoding=encoding)
+
+        # Arquivos de execuções anteriores (outro dia ou compactação interrompida)
+        self._compress_in_background(self._pending_segments())
+
+    def _set_day(self, now):
+        current = datetime.fromtimestamp(now)
+        self._day = current.strftime('%Y%m%d')
+        midnight = datetime(current.year, current.month, current.day) + timedelta(days=1)
+        self._next_day_at = midnight.timestamp()
+
+    def _day_file(self, day):
+        return os.path.join(self.log_dir, f'{self.prefix}_{day}{self.extension}')
+
+    def shouldRollover(self, record):
+        if record.created >= self._next_day_at:
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        # O arquivo atual vira o próximo segmento numerado do seu dia
+        day = self._day
+        segment = None
+        if os.path.exists(self.baseFilename):
+            segment = os.path.join(self.log_dir, f'{self.prefix}_{day}_{self._next_segment_number(day)}{self.extension}')
+            os.replace(self.baseFilename, segment)
+
+        self._set_day(time.time())
+        self.baseFilename = os.path.abspath(self._day_file(self._day))
+        self.stream = self._open()
+
+        self._compress_in_background([segment] if segment else [])
+
+    def _next_segment_number(self, day):
+        numbers = [0]
+        for name in os.listdir(self.log_dir):
+            match = self._segment_pattern.match(name)
+            if match and match.group(1) == day and match.group(2):
+                numbers.append(int(match.group(2)))
+        return max(numbers) + 1
+
+    def _pending_segments(self):
+        """Arquivos que não são o arquivo atual e ainda não foram compactados."""
+        pending = []
+        for name in os.listdir(self.log_dir):
+            match = self._segment_pattern.match(name)
+            path = os.path.join(self.log_dir, name)
+            if match and not match.group(3) and os.path.abspath(path) != self.baseFilename:
+                pending.append(path)
+        return pending
+
+    def _compress_in_background(self, paths):
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        worker = threading.Thread(target=self._compress_and_cleanup, args=(paths,), daemon=True)
+        self._workers.append(worker)
+        worker.start()
+
+    def _compress_and_cleanup(self, paths):
+        for path in paths:
+            try:
+                # Compacta em um arquivo temporário: uma interrupção não deixa um .gz truncado
+                temp_path = f'{path}.gz.tmp'
+                with open(path, 'rb') as source, gzip.open(temp_path, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.replace(temp_path, f'{path}.gz')
+                os.remove(path)
+            except Exception as e:
+                print(f"Erro ao compactar log {path}: {e}")
+
+        if self.retention_days > 0:
+            self._remove_expired()
+
+    def _remove_expired(self):
+        # A idade é a do dia no nome do arquivo (a compactação altera o mtime)
+        limit = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y%m%d')
+        for name in os.listdir(self.log_dir):
+            match = self._segment_pattern.match(name)
+            path = os.path.join(self.log_dir, name)
+            if not match or match.group(1) >= limit or os.path.abspath(path) == self.baseFilename:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        # Aguarda as compactações em andamento antes de encerrar
+        for worker in self._workers:
+            worker.join(timeout=10)
+        super().close()
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formata um evento (dict passado como mensagem do log) como uma linha JSON."""
+
+    def format(self, record):
+        event = {"ts": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')}
+        event.update(record.msg)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+def _read_logging_config():
+    """Lê as configurações de log do config.json (sem criá-lo se não existir)."""
+    return get_config() if os.path.exists(get_config_path()) else {}
+
+def _read_log_file_settings(config):
+    max_mb = float(config.get('log_max_mb', DEFAULT_LOG_MAX_MB))
+    retention_days = float(config.get('log_retention_days', DEFAULT_LOG_RETENTION_DAYS))
+    return int(max_mb * 1024 * 1024), retention_days
+
+def _start_pipeline(logger, output_handlers):
+    """O logger passa a só enfileirar; os handlers de saída são escritos pela thread do listener."""
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    logger.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *output_handlers)
+    listener.start()
+    _pipelines[logger.name] = (listener, queue_handler, output_handlers)
+
+def _stop_pipeline(logger, restore=False):
+    """
+    Grava os registros ainda na fila e encerra a thread do listener. Com
+    restore=True os handlers de saída voltam a ser usados diretamente pelo logger;
+    caso contrário são fechados.
+    """
+    pipeline = _pipelines.pop(logger.name, None)
+    if pipeline is None:
+        return
+    listener, queue_handler, output_handlers = pipeline
+    listener.stop()
+    logger.removeHandler(queue_handler)
+    for handler in output_handlers:
+        if restore:
+            handler.flush()
+            logger.addHandler(handler)
+        else:
+            handler.close()
+
+def _reset_logger(logger):
+    """Remove (e fecha) os handlers atuais do logger, para evitar duplicação."""
+    _stop_pipeline(logger)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+
+def _setup_event_log(log_dir, config):
+    """Ativa o registro de eventos em logs/events_AAAAMMDD.jsonl se "event_log" estiver ligado."""
+    global _event_log_enabled
+    events_logger = logging.getLogger(EVENT_LOGGER_NAME)
+    events_logger.propagate = False
+    events_logger.setLevel(logging.INFO)
+    _reset_logger(events_logger)
+
+    _event_log_enabled = bool(config.get('event_log', False))
+    if not _event_log_enabled:
+        return
+    max_bytes, retention_days = _read_log_file_settings(config)
+    handler = CompressingRotatingFileHandler(
+        log_dir, prefix='events', max_bytes=max_bytes, retention_days=retention_days,
+        encoding='utf-8', extension='.jsonl'
+    )
+    handler.setFormatter(JsonLinesFormatter())
+    _start_pipeline(events_logger, [handler])
 
 def setup_logger(log_level=logging.INFO):
     """Configura o logger com suporte aprimorado a Unicode/Emojis"""
@@ -14,8 +244,8 @@ def setup_logger(log_level=logging.INFO):
     logger.setLevel(log_level)
     
     # Remove handlers antigos para evitar duplicação
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
+    _reset_logger(logger)
+    config = _read_logging_config()
     
     # Cria formatador para logs
     formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', 
@@ -24,38 +254,103 @@ def setup_logger(log_level=logging.INFO):
     # Adiciona handler para enviar logs para o console (com suporte a Unicode)
     console_handler = logging.StreamHandler(stream=sys.stdout)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    output_handlers = [console_handler]
     
     # Usa o diretório de logs definido pelo resource handler
     log_dir = get_logs_dir()
     
-    # Adiciona handler para enviar logs para arquivo com encoding UTF-8
-    log_file = os.path.join(log_dir, f'bot_{datetime.now().strftime("%Y%m%d")}.log')
+    # Adiciona handler para enviar logs para arquivo com encoding UTF-8,
+    # rotacionado por dia e por tamanho
     try:
-        # Usa codecs.open para garantir suporte a UTF-8 com BOM
-        file_handler = logging.FileHandler(log_file, encoding='utf-8-sig')
+        max_bytes, retention_days = _read_log_file_settings(config)
+        # Usa utf-8-sig para garantir suporte a UTF-8 com BOM
+        file_handler = CompressingRotatingFileHandler(
+            log_dir, max_bytes=max_bytes, retention_days=retention_days, encoding='utf-8-sig'
+        )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        output_handlers.append(file_handler)
     except Exception as e:
         print(f"Erro ao configurar log em arquivo: {e}")
         # Adiciona apenas log para console em caso de erro
     
-    # Adiciona handler personalizado para mensagens sem problemas de encoding
-    class EncodingSafeHandler(logging.Handler):
-        def emit(self, record):
-            try:
-                msg = self.format(record)
-                if isinstance(msg, bytes):
-                    msg = msg.decode('utf-8', errors='replace')
-            except Exception:
-                pass
+    # O logger só enfileira; console e arquivo são escritos pela thread do listener
+    _start_pipeline(logger, output_handlers)
     
-    # Adiciona o handler customizado
-    encoding_handler = EncodingSafeHandler()
-    encoding_handler.setFormatter(formatter)
-    logger.addHandler(encoding_handler)
+    # Registro opcional de eventos de replicação em JSON lines
+    try:
+        _setup_event_log(log_dir, config)
+    except Exception as e:
+        print(f"Erro ao configurar o registro de eventos: {e}")
     
     return logger
 
+def get_logger(subsystem):
+    """
+    Logger de um subsistema (ex: 'message_handler'). Os registros seguem para os
+    handlers do logger principal, mas o nível pode ser ajustado por subsistema
+    em "log_levels" no config.json.
+    """
+    return logging.getLogger(f'TelegramForwarderBot.{subsystem}')
+
+def apply_log_levels(config):
+    """Aplica os níveis de "log_levels" do config.json (ex: {"message_handler": "WARNING"})."""
+    for subsystem, level in config.get('log_levels', {}).items():
+        numeric_level = getattr(logging, str(level).upper(), None)
+        if not isinstance(numeric_level, int):
+            logging.getLogger('TelegramForwarderBot').warning(f"Nível de log inválido para {subsystem}: {level}")
+            continue
+        get_logger(subsystem).setLevel(numeric_level)
+
+def is_event_log_enabled():
+    return _event_log_enabled
+
+def mark_received(obj):
+    """Marca o momento em que o evento chegou (base da latência do registro de eventos)."""
+    if getattr(obj, 'received_at', None) is None:
+        obj.received_at = time.monotonic()
+    return obj.received_at
+
+def log_replication_event(operation, source_chat, source_msg, dest_chat, outcome,
+                          dest_msg=None, size=None, received_at=None, **extra):
+    """
+    Registra um evento de replicação (operation: send/edit/delete) no log JSON lines.
+    A latência é medida de received_at (ver mark_received) até agora. Não faz nada
+    se "event_log" estiver desligado; a serialização e a escrita acontecem na thread
+    do listener.
+    """
+    if not _event_log_enabled:
+        return
+    event = {
+        "op": operation,
+        "source_chat": source_chat,
+        "source_msg": source_msg,
+        "dest_chat": dest_chat,
+        "dest_msg": dest_msg,
+        "bytes": size,
+        "latency_ms": round((time.monotonic() - received_at) * 1000, 1) if received_at else None,
+        "outcome": outcome,
+    }
+    event.update(extra)
+    logging.getLogger(EVENT_LOGGER_NAME).info(event)
+
+def get_dropped_count():
+    """Quantidade de registros de log descartados por fila cheia."""
+    return sum(queue_handler.dropped for _, queue_handler, _ in _pipelines.values())
+
+def shutdown_logging():
+    """
+    Esvazia as filas de log no encerramento. Depois disso os registros voltam a
+    ser escritos diretamente, para que as últimas mensagens não se percam.
+    """
+    logger = logging.getLogger('TelegramForwarderBot')
+    dropped = get_dropped_count()
+    if dropped:
+        logger.warning(f"{dropped} mensagens de log descartadas por excesso de volume")
+    
+    for name in list(_pipelines):
+        _stop_pipeline(logging.getLogger(name), restore=True)
+
+atexit.register(shutdown_logging)
+
 # Configuração global do logger
 logger = setup_logger()
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import io
+import tempfile
+from contextlib import asynccontextmanager
+from telethon import helpers, utils
+from telethon.tl import functions, types
+from telethon.tl.custom import InputSizedFile
+from utils.logger import logger
+
+# Padrões de configuração (em MB)
+DEFAULT_SPOOL_THRESHOLD_MB = 20
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+# Quantidade de partes enviadas em paralelo enquanto o download continua
+UPLOAD_PARALLEL_PARTS = 4
+
+# Acima deste tamanho o Telegram exige o upload em partes "grandes"
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+class MemoryBudget:
+    """
+    Limita o total de bytes de mídia em memória ao mesmo tempo.
+
+    Cada relay reserva os bytes que vai manter em RAM (o arquivo inteiro no
+    modo em memória ou só as partes em trânsito no modo em disco) e aguarda
+    enquanto o orçamento estiver esgotado. Uma reserva maior que o orçamento
+    total é reduzida ao orçamento, para não travar para sempre.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = max(1, int(limit_bytes))
+        self.in_use = 0
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size):
+        size = min(max(0, int(size)), self.limit)
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.in_use + size <= self.limit)
+            finally:
+                self.waiting -= 1
+            self.in_use += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= size
+                self._condition.notify_all()
+
+    def get_stats(self):
+        """Retorna o orçamento, os bytes reservados e os relays aguardando."""
+        return {"limit": self.limit, "in_use": self.in_use, "waiting": self.waiting}
+
+_budget = None
+
+def get_memory_budget(config):
+    """Retorna o orçamento global de memória, recriando-o se o limite configurado mudar."""
+    global _budget
+    limit = int(config.get('media_memory_budget_mb', DEFAULT_MEMORY_BUDGET_MB)) * 1024 * 1024
+    if _budget is None or (_budget.limit != limit and _budget.in_use == 0):
+        _budget = MemoryBudget(limit)
+    return _budget
+
+class _PartUploader:
+    """Envia as partes de um arquivo ao Telegram à medida que são baixadas."""
+
+    def __init__(self, client, file_size, file_name, part_size):
+        self.client = client
+        self.file_size = file_size
+        self.file_name = file_name
+        self.part_size = part_size
+        self.part_count = (file_size + part_size - 1) // part_size
+        self.is_big = file_size > BIG_FILE_SIZE
+        self.file_id = helpers.generate_random_long()
+        self._md5 = hashlib.md5()
+        self._next_part = 0
+        self._slots = asyncio.Semaphore(UPLOAD_PARALLEL_PARTS)
+        self._tasks = []
+
+    async def put(self, part):
+        """Agenda o envio da próxima parte; aguarda se já houver partes demais em trânsito."""
+        if self._next_part >= self.part_count:
+            raise ValueError("Arquivo maior que o tamanho informado")
+        if not self.is_big:
+            self._md5.update(part)
+
+        await self._slots.acquire()
+        # Propaga logo a falha de uma parte anterior em vez de continuar baixando
+        for task in self._tasks:
+            if task.done() and task.exception():
+                self._slots.release()
+                raise task.exception()
+
+        self._tasks.append(asyncio.create_task(self._save_part(self._next_part, part)))
+        self._next_part += 1
+
+    async def _save_part(self, index, part):
+        try:
+            if self.is_big:
+                request = functions.upload.SaveBigFilePartRequest(self.file_id, index, self.part_count, part)
+            else:
+                request = functions.upload.SaveFilePartRequest(self.file_id, index, part)
+            if not await self.client(request):
+                raise RuntimeError(f"Falha ao enviar a parte {index} do arquivo")
+        finally:
+            self._slots.release()
+
+    async def finish(self):
+        """Aguarda as partes pendentes e retorna o InputFile pronto para send_file."""
+        await asyncio.gather(*self._tasks)
+        if self._next_part != self.part_count:
+            raise ValueError("Arquivo menor que o tamanho informado")
+        if self.is_big:
+            return types.InputFileBig(self.file_id, self.part_count, self.file_name)
+        return InputSizedFile(self.file_id, self.part_count, self.file_name, md5=self._md5, size=self.file_size)
+
+    def cancel(self):
+        """Cancela as partes em trânsito (o arquivo será reenviado a partir do buffer)."""
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # Marca a exceção como tratada
+
+    async def close(self):
+        """Cancela e aguarda as partes em trânsito, para que nenhuma continue depois do relay."""
+        self.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+async def relay_media(client, message, file_name, config):
+    """
+    Baixa a mídia da mensagem e a envia ao Telegram, retornando um InputFile
+    reaproveitável por todos os destinos.
+
+    Arquivos até 'media_spool_threshold_mb' ficam em memória; acima disso são
+    gravados em um arquivo temporário. Quando o tamanho é conhecido, cada parte
+    é enviada assim que baixada, sobrepondo download e upload. O total de bytes
+    em memória ao mesmo tempo é limitado por 'media_memory_budget_mb'.
+    """
+    file_size = message.file.size if message.file else None
+    threshold = int(config.get('media_spool_threshold_mb', DEFAULT_SPOOL_THRESHOLD_MB)) * 1024 * 1024
+    spool = file_size is None or file_size > threshold
+    part_size = utils.get_appropriated_part_size(file_size or 0) * 1024
+
+    # Só documentos são enviados em partes durante o download: o tamanho de
+    # fotos é estimado e pode não bater com o que é baixado
+    uploader = None
+    if file_size and message.document:
+        uploader = _PartUploader(client, file_size, file_name, part_size)
+
+    reserved = UPLOAD_PARALLEL_PARTS * part_size if spool else file_size
+    async with get_memory_budget(config).reserve(reserved):
+        buffer = tempfile.TemporaryFile() if spool else io.BytesIO()
+        try:
+            streaming = uploader is not None
+            async for chunk in client.iter_download(message.media, chunk_size=part_size, file_size=file_size):
+                buffer.write(chunk)
+                if streaming:
+                    try:
+                        await uploader.put(chunk)
+                    except Exception as e:
+                        # Segue só baixando; o arquivo é enviado do buffer ao final
+                        streaming = False
+                        await uploader.close()
+                        logger.warning(f"Upload em partes de {file_name} falhou ({e}), enviando a partir do buffer")
+
+            if streaming:
+                try:
+                    return await uploader.finish()
+                except Exception as e:
+                    await uploader.close()
+                    logger.warning(f"Upload em partes de {file_name} falhou ({e}), enviando a partir do buffer")
+
+            downloaded = buffer.tell()
+            buffer.seek(0)
+            return await client.upload_file(buffer, file_size=downloaded, file_name=file_name)
+        finally:
+            # Se o download falhar no meio, as partes em trânsito são canceladas e aguardadas
+            # antes de liberar a reserva do orçamento de memória
+            if uploader is not None:
+                await uploader.close()
+            buffer.close()
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from telethon import errors
+from utils.logger import logger
+from utils.resource_handler import get_config
+
+# Limites padrão (chamadas por segundo e rajada máxima)
+DEFAULT_GLOBAL_RATE = 25.0
+DEFAULT_GLOBAL_BURST = 30
+DEFAULT_CHAT_RATE = 1.0
+DEFAULT_CHAT_BURST = 5
+
+# Tentativas após FloodWait antes de desistir da operação
+FLOOD_MAX_RETRIES = 5
+
+# FloodWaits a partir deste tempo (s) pausam também o limite global
+GLOBAL_FLOOD_THRESHOLD = 30
+
+# flood_sleep_threshold do TelegramClient: com 0 o Telethon não dorme escondido dentro
+# da chamada e todo FloodWait chega ao limitador (que pausa os baldes e libera o slot)
+CLIENT_FLOOD_SLEEP_THRESHOLD = 0
+
+class TokenBucket:
+    """
+    Balde de fichas: permite `rate` chamadas por segundo com rajadas de até `burst`.
+    Com rate 0 o balde não limita (só as pausas de FloodWait continuam valendo).
+    """
+
+    def __init__(self, rate, burst):
+        if rate < 0:
+            raise ValueError(f"taxa do limitador não pode ser negativa: {rate}")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # Pausa imposta por FloodWait
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Aguarda até haver uma ficha disponível (e a pausa de FloodWait ter acabado)."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                if self.rate == 0:
+                    return
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds):
+        """Pausa o balde por `seconds` segundos e zera as fichas acumuladas."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def remaining_block(self, now=None):
+        return max(0.0, self.blocked_until - (now or time.monotonic()))
+
+class RateLimiter:
+    """
+    Limita as chamadas à API com um balde global e um balde por chat de destino.
+
+    Um FloodWaitError pausa o balde do chat (e o global, se a espera for longa)
+    pelo tempo pedido pelo Telegram; a operação é então repetida em vez de
+    descartada. Como roda dentro da fila do destino, a ordem das mensagens
+    é mantida durante a espera.
+    """
+
+    def __init__(self):
+        self._global = None
+        self._chats = {}
+        self.flood_waits = 0
+        self.last_flood = None  # (chat, segundos, momento)
+        self._invalid_rates = set()
+        self.configure({})
+
+    def configure(self, config):
+        """Aplica os limites das configurações (barato se nada mudou). 0 desativa o limite."""
+        global_rate = self._read_rate(config, 'rate_limit_global_per_sec', DEFAULT_GLOBAL_RATE)
+        chat_rate = self._read_rate(config, 'rate_limit_chat_per_sec', DEFAULT_CHAT_RATE)
+        if self._global is None or self._global.rate != global_rate:
+            self._global = TokenBucket(global_rate, max(DEFAULT_GLOBAL_BURST, int(global_rate)))
+        self.chat_rate = chat_rate
+
+    def _read_rate(self, config, key, default):
+        try:
+            rate = float(config.get(key, default))
+        except (TypeError, ValueError):
+            rate = -1
+        if rate < 0:
+            # Avisa uma vez por valor inválido (configure roda a cada envio)
+            invalid = (key, repr(config.get(key)))
+            if invalid not in self._invalid_rates:
+                self._invalid_rates.add(invalid)
+                logger.warning(f"Valor inválido em {key}: {config.get(key)!r}. Usando o padrão {default}/s (use 0 para não limitar)")
+            return default
+        return rate
+
+    def _bucket(self, chat):
+        bucket = self._chats.get(chat)
+        if bucket is None or bucket.rate != self.chat_rate:
+            bucket = TokenBucket(self.chat_rate, max(DEFAULT_CHAT_BURST, int(self.chat_rate)))
+            if chat in self._chats:
+                bucket.blocked_until = self._chats[chat].blocked_until
+            self._chats[chat] = bucket
+        return bucket
+
+    async def run(self, chat, func, *args, slot=None, **kwargs):
+        """
+        Executa func(*args, **kwargs) respeitando os limites, repetindo após FloodWait.
+        Se slot (ex.: um asyncio.Semaphore) for informado, ele é mantido só durante a
+        chamada: a espera por fichas e as pausas de FloodWait não ocupam o slot.
+        """
+        self.configure(get_config())
+        bucket = self._bucket(chat)
+        for attempt in range(FLOOD_MAX_RETRIES + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                if slot is None:
+                    return await func(*args, **kwargs)
+                async with slot:
+                    return await func(*args, **kwargs)
+            except errors.FloodWaitError as e:
+                self.flood_waits += 1
+                self.last_flood = (chat, e.seconds, time.time())
+                if attempt == FLOOD_MAX_RETRIES:
+                    logger.error(f"FloodWait persistente no chat {chat}; operação descartada após {attempt + 1} tentativas")
+                    raise
+                logger.warning(f"FloodWait de {e.seconds}s no chat {chat}. Operação adiada (tentativa {attempt + 1}/{FLOOD_MAX_RETRIES})")
+                bucket.block(e.seconds)
+                if e.seconds >= GLOBAL_FLOOD_THRESHOLD:
+                    self._global.block(e.seconds)
+
+    async def iter_history(self, client, chat, min_id=0, max_id=0, limit=None):
+        """
+        client.iter_messages(chat, reverse=True) que sobrevive a FloodWaits: como o
+        cliente não dorme sozinho (CLIENT_FLOOD_SLEEP_THRESHOLD), espera o tempo pedido
+        e retoma a leitura a partir da última mensagem já entregue.
+        """
+        delivered = 0
+        for attempt in range(FLOOD_MAX_RETRIES + 1):
+            try:
+                remaining = None if limit is None else limit - delivered
+                async for message in client.iter_messages(chat, min_id=min_id, max_id=max_id, reverse=True, limit=remaining):
+                    min_id = message.id
+                    delivered += 1
+                    yield message
+                return
+            except errors.FloodWaitError as e:
+                self.flood_waits += 1
+                self.last_flood = (chat, e.seconds, time.time())
+                if attempt == FLOOD_MAX_RETRIES:
+                    raise
+                logger.warning(f"FloodWait de {e.seconds}s lendo o histórico do chat {chat}. Leitura retomada em seguida")
+                await asyncio.sleep(e.seconds)
+
+    def get_stats(self):
+        """Retorna o estado atual dos limites: pausas ativas e contagem de FloodWaits."""
+        now = time.monotonic()
+        return {
+            "global_rate": self._global.rate,
+            "chat_rate": self.chat_rate,
+            "global_blocked": self._global.remaining_block(now),
+            "blocked_chats": {
+                chat: bucket.remaining_block(now)
+                for chat, bucket in self._chats.items() if bucket.remaining_block(now) > 0
+            },
+            "flood_waits": self.flood_waits,
+            "last_flood": self.last_flood,
+        }
+
+# Instância global do limitador
+rate_limiter = RateLimiter()
@@ -6,6 +6,11 @@ import hashlib
 import platform
 import hmac
 import uuid
+import time
+import atexit
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
 
 # Configuração de logger local para evitar dependência circular
 _local_logger = logging.getLogger('ResourceHandler')
@@ -77,6 +82,10 @@ def load_config():
             "destination_chats": [],
             "chat_id": 0,
             "log_level": "INFO",
+            "log_levels": {},
+            "log_max_mb": 50,
+            "log_retention_days": 14,
+            "event_log": False,
             "blocked_words": [],
             "replacements": {},
             "sticker_replacements": {},
@@ -86,7 +95,16 @@ def load_config():
                 "start_time": "00:00",
                 "end_time": "00:00"
             },
-            "replicar_apenas_texto": False
+            "replicar_apenas_texto": False,
+            "max_concurrent_sends": 10,
+            "media_spool_threshold_mb": 20,
+            "media_memory_budget_mb": 256,
+            "album_window_ms": 800,
+            "rate_limit_global_per_sec": 25,
+            "rate_limit_chat_per_sec": 1,
+            "backfill_max_per_sec": 5,
+            "backfill_max_messages": 5000,
+            "forward_unchanged": True
         }
         
         with open(config_path, 'w', encoding='utf-8') as f:
@@ -103,16 +121,90 @@ def load_config():
         return {}
 
 def save_config(config):
-    """Salva o arquivo de configuração."""
+    """Salva o arquivo de configuração e atualiza o snapshot em memória."""
     config_path = get_config_path()
     try:
         with open(config_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=4, ensure_ascii=False)
+        _update_config_snapshot(config, _get_config_mtime(config_path))
         return True
     except Exception as e:
         _local_logger.error(f"Erro ao salvar configurações: {e}")
         return False
 
+def _freeze(value):
+    """Converte dicts e listas do JSON em estruturas somente leitura."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+class ConfigSnapshot(Mapping):
+    """
+    Snapshot imutável do config.json.
+    O atributo version é incrementado a cada recarga, permitindo que estruturas
+    derivadas da configuração (ex: filtros compilados) sejam reconstruídas só quando necessário.
+    """
+
+    def __init__(self, data, version, mtime):
+        self._data = _freeze(dict(data))
+        self.version = version
+        self.mtime = mtime
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"ConfigSnapshot(version={self.version}, keys={list(self._data)})"
+
+# Snapshot atual da configuração e controle de verificação do arquivo
+CONFIG_CHECK_INTERVAL = 1.0  # Intervalo mínimo (s) entre verificações do mtime do config.json
+_config_snapshot = None
+_config_last_check = 0.0
+
+def _get_config_mtime(config_path):
+    try:
+        return os.stat(config_path).st_mtime_ns
+    except OSError:
+        return None
+
+def _update_config_snapshot(config, mtime):
+    global _config_snapshot, _config_last_check
+    version = _config_snapshot.version + 1 if _config_snapshot is not None else 1
+    _config_snapshot = ConfigSnapshot(config, version, mtime)
+    _config_last_check = time.monotonic()
+    return _config_snapshot
+
+def get_config():
+    """
+    Retorna o snapshot imutável da configuração.
+    O arquivo só é relido quando seu mtime muda (verificado no máximo a cada
+    CONFIG_CHECK_INTERVAL segundos) ou quando save_config grava o arquivo.
+    """
+    global _config_last_check
+    now = time.monotonic()
+    if _config_snapshot is not None and now - _config_last_check < CONFIG_CHECK_INTERVAL:
+        return _config_snapshot
+
+    _config_last_check = now
+    config_path = get_config_path()
+    mtime = _get_config_mtime(config_path)
+    if _config_snapshot is None or mtime is None or mtime != _config_snapshot.mtime:
+        config = load_config()
+        if _config_snapshot is not None and _config_snapshot.mtime is not None and not config:
+            # Mantém o snapshot anterior se o arquivo estiver sendo reescrito ou inválido
+            return _config_snapshot
+        _update_config_snapshot(config, _get_config_mtime(config_path))
+        _local_logger.debug(f"Configuração recarregada (versão {_config_snapshot.version})")
+    return _config_snapshot
+
 SECRET_KEY = "super_secret_key"  # Chave secreta para gerar/verificar o hash
 
 def get_hidden_data_dir():
@@ -131,12 +223,29 @@ def ensure_hidden_data_dir():
 LIMIT_FILE = os.path.join(ensure_hidden_data_dir(), 'usage_limits.json')
 MAX_ACTIONS = 50
 
+# Atraso (s) para gravar o contador após uma ação; ações seguidas geram uma só gravação
+USAGE_SAVE_DELAY = 2.0
+
+# Estado de uso em memória (carregado do arquivo uma vez por processo)
+_machine_id = None
+_usage_data = None
+_usage_dirty = False
+_usage_save_timer = None
+_usage_lock = threading.RLock()
+
 def calculate_hash(data):
     """Calcula o hash assinado do conteúdo."""
     serialized_data = json.dumps(data, sort_keys=True).encode('utf-8')
     return hmac.new(SECRET_KEY.encode('utf-8'), serialized_data, hashlib.sha256).hexdigest()
 
 def get_machine_id():
+    """Retorna o ID da máquina, calculado uma única vez por processo."""
+    global _machine_id
+    if _machine_id is None:
+        _machine_id = _compute_machine_id()
+    return _machine_id
+
+def _compute_machine_id():
     """Gera um ID único baseado em múltiplos identificadores do sistema."""
     try:
         # Identificadores do sistema
@@ -171,9 +280,21 @@ def get_disk_serial():
         return "unknown_serial"
 
 def load_usage_data():
+    """Retorna os dados de uso atuais (contador de ações e ID da máquina)."""
+    with _usage_lock:
+        return dict(_get_usage_data())
+
+def _get_usage_data():
+    """Dados de uso em memória; o arquivo só é lido (e o hash verificado) no primeiro acesso."""
+    global _usage_data
+    if _usage_data is None:
+        _usage_data = _read_usage_file()
+    return _usage_data
+
+def _read_usage_file():
     """Carrega os dados de uso (contador de ações e ID da máquina) com verificação de hash."""
     if not os.path.exists(LIMIT_FILE):
-        return {"machine_id": get_machine_id(), "actions": 0, "hash": ""}
+        return {"machine_id": get_machine_id(), "actions": 0}
 
     try:
         with open(LIMIT_FILE, 'r', encoding='utf-8') as f:
@@ -193,26 +314,54 @@ def load_usage_data():
 def save_usage_data(data):
     """Salva os dados de uso no arquivo com hash assinado."""
     try:
+        data = {key: value for key, value in data.items() if key != "hash"}
         data_to_save = data.copy()
         data_to_save["hash"] = calculate_hash(data)
-        with open(LIMIT_FILE, 'w', encoding='utf-8') as f:
+        # Grava em um arquivo temporário e substitui o original: uma queda no meio
+        # da gravação não deixa o arquivo truncado (o que bloquearia o acesso)
+        temp_file = f"{LIMIT_FILE}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
             json.dump(data_to_save, f, indent=4, ensure_ascii=False)
+        os.replace(temp_file, LIMIT_FILE)
     except Exception as e:
         _local_logger.error(f"Erro ao salvar dados de uso: {e}")
 
+def _schedule_usage_save():
+    """Agenda a gravação do contador, agrupando as ações dos próximos USAGE_SAVE_DELAY segundos."""
+    global _usage_dirty, _usage_save_timer
+    _usage_dirty = True
+    if _usage_save_timer is None:
+        _usage_save_timer = threading.Timer(USAGE_SAVE_DELAY, flush_usage_data)
+        _usage_save_timer.daemon = True
+        _usage_save_timer.start()
+
+def flush_usage_data():
+    """Grava imediatamente o contador de ações pendente (chamado também no encerramento)."""
+    global _usage_dirty, _usage_save_timer
+    with _usage_lock:
+        if _usage_save_timer is not None:
+            _usage_save_timer.cancel()
+            _usage_save_timer = None
+        if _usage_dirty:
+            _usage_dirty = False
+            save_usage_data(_usage_data)
+
+atexit.register(flush_usage_data)
+
 def increment_action_count():
     """Incrementa o contador de ações e verifica o limite."""
-    data = load_usage_data()
-    if data.get("machine_id") != get_machine_id():
-        _local_logger.error("ID da máquina não corresponde. Bloqueando acesso.")
-        return False  # Bloqueia se o ID da máquina não corresponder
-    if data["actions"] >= MAX_ACTIONS:
-        return False  # Limite atingido
-    data["actions"] += 1
-    save_usage_data(data)
-    return True
+    with _usage_lock:
+        data = _get_usage_data()
+        if data.get("machine_id") != get_machine_id():
+            _local_logger.error("ID da máquina não corresponde. Bloqueando acesso.")
+            return False  # Bloqueia se o ID da máquina não corresponder
+        if data["actions"] >= MAX_ACTIONS:
+            return False  # Limite atingido
+        data["actions"] += 1
+        _schedule_usage_save()
+        return True
 
 def is_limit_reached():
     """Verifica se o limite de ações foi atingido."""
-    data = load_usage_data()
-    return data["actions"] >= MAX_ACTIONS
+    with _usage_lock:
+        return _get_usage_data()["actions"] >= MAX_ACTIONS
@@ -1,10 +1,12 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
+import asyncio
 import json
 import logging
 import os
 from utils.resource_handler import load_config, get_config_path
+from database.db_manager import get_db
 
 logger = logging.getLogger('TelegramForwarderBot')
 
@@ -14,6 +16,36 @@ is_active = True  # Começa como ativo por padrão
 telegram_client = None
 # Armazena a instância do agendador para controle global
 current_scheduler = None
+# Intervalo da manutenção do banco de dados e atraso da primeira execução após iniciar
+DB_MAINTENANCE_INTERVAL_HOURS = 6
+DB_MAINTENANCE_FIRST_RUN_MINUTES = 10
+# Corrotinas chamadas sempre que o bot passa de inativo para ativo
+_activation_callbacks = []
+
+def register_activation_callback(callback):
+    """
+    Registra uma função assíncrona callback() executada sempre que o bot for ativado.
+    callback() é chamada de forma síncrona no momento da ativação; só a corrotina
+    retornada roda em segundo plano.
+    """
+    _activation_callbacks.append(callback)
+
+def _run_activation_callbacks():
+    """Dispara os callbacks de ativação em segundo plano."""
+    for callback in _activation_callbacks:
+        asyncio.create_task(callback())
+
+def _set_active(status: bool):
+    """
+    Altera o estado do bot. Toda passagem de inativo para ativo dispara os callbacks
+    de ativação, seja pelo horário agendado, seja pela (re)configuração do agendador.
+    """
+    global is_active
+    was_active = is_active
+    is_active = status
+    # Disparados antes de qualquer await, para que vejam o estado anterior às mensagens ao vivo
+    if status and not was_active:
+        _run_activation_callbacks()
 
 async def notify_status_change(status: bool):
     """Notifica mudança de status para o chat configurado."""
@@ -54,16 +86,13 @@ async def toggle_active_status(status: bool):
     
     # Somente prossegue se houver mudança de status
     if current_status != status:
-        # Importante: modifica a variável global
-        is_active = status
+        # Importante: modifica a variável global (e, na ativação, dispara os callbacks registrados,
+        # ex.: backfill das mensagens perdidas)
+        _set_active(status)
         
         # Log mais descritivo para debug
         logger.info(f"Bot {'ativado' if status else 'desativado'} pelo agendador. Status anterior: {'ativo' if current_status else 'inativo'}")
         
-        # Força a atualização imediata via variável global
-        # Isso garante que outras partes do código vejam o novo valor
-        globals()['is_active'] = status
-        
         # Envia notificação sobre a mudança de status
         await notify_status_change(status)
     else:
@@ -139,7 +168,7 @@ def setup_scheduler(client=None):
             current_is_active = _is_time_between(start_time, end_time)
             
             # Define o estado inicial do bot
-            is_active = current_is_active
+            _set_active(current_is_active)
             logger.info(f"Estado inicial do bot definido como: {'ativo' if is_active else 'inativo'}")
             
             # Extrai as horas e minutos para configurar os triggers
@@ -186,11 +215,23 @@ def setup_scheduler(client=None):
             logger.info(f"Próxima ativação: {start_hour:02d}:{start_minute:02d}, próxima desativação: {end_hour:02d}:{end_minute:02d}")
         else:
             logger.info("Agendamento desabilitado no config.json.")
-            is_active = True  # Se o agendamento estiver desabilitado, o bot estará sempre ativo
+            _set_active(True)  # Se o agendamento estiver desabilitado, o bot estará sempre ativo
         
     except Exception as e:
         logger.error(f"Erro ao configurar agendador: {e}", exc_info=True)
-        is_active = True  # Em caso de erro, o bot deve ficar ativo por padrão
+        _set_active(True)  # Em caso de erro, o bot deve ficar ativo por padrão
+    
+    # Manutenção do banco de dados em segundo plano (independe do agendamento de horários)
+    scheduler.add_job(
+        run_db_maintenance,
+        'interval',
+        hours=DB_MAINTENANCE_INTERVAL_HOURS,
+        next_run_time=datetime.now() + timedelta(minutes=DB_MAINTENANCE_FIRST_RUN_MINUTES),
+        id='db_maintenance',
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
     
     # Start the scheduler
     try:
@@ -201,6 +242,13 @@ def setup_scheduler(client=None):
     
     return scheduler
 
+async def run_db_maintenance():
+    """Executa a manutenção periódica do banco de dados compartilhado."""
+    try:
+        await get_db().run_maintenance()
+    except Exception as e:
+        logger.error(f"Erro na manutenção agendada do banco de dados: {e}")
+
 def log_next_schedule_events():
     """Logs the next scheduled activation and deactivation times."""
     try:
@@ -252,39 +300,6 @@ def log_next_schedule_events():
     except Exception as e:
         logger.error(f"Erro ao registrar próximos eventos de agendamento: {e}")
 
-def check_schedule_status():
-    """Verifica periodicamente se o estado atual corresponde ao esperado com base no horário."""
-    global is_active
-    
-    try:
-        # Load current configuration
-        config = load_config()
-        schedule_config = config.get('schedule', {})
-        
-        # Only check if scheduling is enabled
-        if schedule_config.get('enable', False):
-            start_time = schedule_config.get('start_time', '00:00')
-            end_time = schedule_config.get('end_time', '00:00')
-            
-            # Check if we're in the active time window
-            should_be_active = _is_time_between(start_time, end_time)
-            
-            # If there's a mismatch, fix it
-            if should_be_active != is_active:
-                logger.warning(f"Detectada inconsistência no estado do bot: deveria estar {'ativo' if should_be_active else 'inativo'}, mas está {'ativo' if is_active else 'inativo'}")
-                is_active = should_be_active
-                # Force global update
-                globals()['is_active'] = should_be_active
-                logger.info(f"Estado corrigido para: {'ativo' if should_be_active else 'inativo'}")
-                
-                # Notify about the change asynchronously
-                if telegram_client:
-                    import asyncio
-                    asyncio.create_task(notify_status_change(should_be_active))
-    
-    except Exception as e:
-        logger.error(f"Erro ao verificar status do agendamento: {e}")
-
 # Função para recarregar o agendador quando as configurações são alteradas
 async def reload_scheduler(client=None):
     """Recarrega o agendador depois que as configurações forem alteradas."""
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from telethon import errors, utils
+from telethon.tl.types import InputDocument, InputPhoto
+from utils.logger import logger
+from utils.resource_handler import get_data_dir
+
+# Arquivo onde ficam salvos os uploads já realizados
+UPLOAD_CACHE_FILE = os.path.join(get_data_dir(), 'upload_cache.json')
+
+# Erros que indicam que o handle salvo não vale mais (referência expirada, outra conta, etc.)
+STALE_HANDLE_ERRORS = (
+    errors.FileReferenceExpiredError,
+    errors.FileReferenceInvalidError,
+    errors.FileReferenceEmptyError,
+    errors.MediaEmptyError,
+    errors.MediaInvalidError,
+)
+
+class UploadCache:
+    """
+    Cache persistente dos arquivos de substituição já enviados ao Telegram.
+
+    A chave é o hash SHA-256 do conteúdo do arquivo e o valor é o
+    InputDocument/InputPhoto devolvido pelo primeiro envio. Os envios
+    seguintes reaproveitam esse handle em vez de subir o arquivo de novo;
+    quando a referência expira, a entrada é descartada e o arquivo é
+    reenviado uma única vez para renovar o cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}  # hash do conteúdo -> dados do handle
+        self._hashes = {}  # caminho -> (mtime_ns, tamanho, hash)
+        self._locks = {}  # hash do conteúdo -> asyncio.Lock do primeiro upload
+        self.hits = 0
+        self.uploads = 0
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+        except Exception as e:
+            logger.error(f"Erro ao carregar cache de uploads: {e}")
+            self._entries = {}
+
+    def _save(self):
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Erro ao salvar cache de uploads: {e}")
+
+    def file_hash(self, path, file_stat=None):
+        """
+        Hash SHA-256 do conteúdo do arquivo, recalculado só quando o arquivo muda.
+        Se file_stat for informado (ex.: vindo do índice de mídias), evita o os.stat.
+        """
+        stat = file_stat or os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return content_hash
+
+    def get(self, content_hash):
+        """Retorna o InputDocument/InputPhoto salvo para o hash, ou None."""
+        entry = self._entries.get(content_hash)
+        if not entry:
+            return None
+        try:
+            handle_type = InputPhoto if entry['type'] == 'photo' else InputDocument
+            return handle_type(
+                id=entry['id'],
+                access_hash=entry['access_hash'],
+                file_reference=bytes.fromhex(entry['file_reference'])
+            )
+        except Exception:
+            self._entries.pop(content_hash, None)
+            return None
+
+    def store(self, content_hash, path, sent_msg):
+        """Salva o handle da mídia de uma mensagem recém-enviada."""
+        if sent_msg is None:
+            return
+        if getattr(sent_msg, 'photo', None):
+            handle, handle_type = utils.get_input_photo(sent_msg.photo), 'photo'
+        elif getattr(sent_msg, 'document', None):
+            handle, handle_type = utils.get_input_document(sent_msg.document), 'document'
+        else:
+            return
+
+        self._entries[content_hash] = {
+            "type": handle_type,
+            "id": handle.id,
+            "access_hash": handle.access_hash,
+            "file_reference": (handle.file_reference or b'').hex(),
+            "file_name": os.path.basename(path),
+            "updated_at": int(time.time())
+        }
+        self._save()
+
+    def invalidate(self, content_hash):
+        """Descarta o handle salvo para o hash."""
+        if self._entries.pop(content_hash, None) is not None:
+            self._save()
+
+    def _rehash(self, path, restat=None):
+        """Refaz o stat do arquivo (via restat, se informado) e devolve o hash do conteúdo atual."""
+        return self.file_hash(path, restat(path) if restat else None)
+
+    async def send_file(self, client, entity, path, file_stat=None, restat=None, **kwargs):
+        """
+        Envia o arquivo local para entity reaproveitando o upload anterior do
+        mesmo conteúdo. Envios simultâneos de um arquivo ainda não enviado
+        aguardam o primeiro upload em vez de subir o arquivo em paralelo.
+
+        file_stat é o stat já conhecido do arquivo; ele só é refeito (com restat,
+        que atualiza o índice de mídias) quando o handle salvo é recusado, pois o
+        arquivo pode ter sido sobrescrito desde a indexação.
+        """
+        content_hash = self.file_hash(path, file_stat)
+
+        handle = self.get(content_hash)
+        if handle is not None:
+            try:
+                sent_msg = await client.send_file(entity, handle, **kwargs)
+                self.hits += 1
+                return sent_msg
+            except STALE_HANDLE_ERRORS as e:
+                logger.info(f"Upload em cache de {os.path.basename(path)} expirou ({e.__class__.__name__}). Reenviando arquivo.")
+                if self.get(content_hash) == handle:
+                    self.invalidate(content_hash)
+                content_hash = self._rehash(path, restat)
+
+        lock = self._locks.setdefault(content_hash, asyncio.Lock())
+        async with lock:
+            # Outro envio pode ter concluído o upload enquanto aguardávamos
+            handle = self.get(content_hash)
+            if handle is not None:
+                sent_msg = await client.send_file(entity, handle, **kwargs)
+                self.hits += 1
+                return sent_msg
+
+            sent_msg = await client.send_file(entity, path, **kwargs)
+            self.uploads += 1
+            self.store(content_hash, path, sent_msg)
+            logger.debug(f"Upload de {os.path.basename(path)} salvo em cache")
+            return sent_msg
+
+    async def send_album(self, client, entity, files, local_paths, file_stats=None, restat=None, **kwargs):
+        """
+        Envia um álbum em uma única chamada. local_paths traz, na posição de cada item,
+        o caminho do arquivo de substituição local (ou None para as demais mídias): os
+        já enviados antes seguem pelo handle salvo e os novos são salvos a partir da resposta.
+        file_stats e restat têm o mesmo papel que em send_file.
+        """
+        file_stats = file_stats or [None] * len(local_paths)
+        hashes = [self.file_hash(path, file_stat) if path else None
+                  for path, file_stat in zip(local_paths, file_stats)]
+        handles = [self.get(content_hash) if content_hash else None for content_hash in hashes]
+        try:
+            sent_msgs = await client.send_file(
+                entity, [handle or file for handle, file in zip(handles, files)], **kwargs
+            )
+        except STALE_HANDLE_ERRORS as e:
+            if not any(handles):
+                raise
+            logger.info(f"Upload em cache de um item do álbum expirou ({e.__class__.__name__}). Reenviando arquivos.")
+            for content_hash, handle in zip(hashes, handles):
+                if handle is not None:
+                    self.invalidate(content_hash)
+            handles = [None] * len(files)
+            hashes = [self._rehash(path, restat) if path else None for path in local_paths]
+            sent_msgs = await client.send_file(entity, files, **kwargs)
+
+        if not isinstance(sent_msgs, list):
+            sent_msgs = [sent_msgs]
+        # A resposta vem na mesma ordem dos arquivos enviados
+        for content_hash, path, handle, sent_msg in zip(hashes, local_paths, handles, sent_msgs):
+            if content_hash is None:
+                continue
+            if handle is not None:
+                self.hits += 1
+            else:
+                self.uploads += 1
+                self.store(content_hash, path, sent_msg)
+        return sent_msgs
+
+# Instância global do cache de uploads
+upload_cache = UploadCache(UPLOAD_CACHE_FILE)